@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Synthetic-scale benchmark of the mapping_facts lsmap parsers.
+
+Generates lsmap -fmt output in the field layouts documented in
+plugins/modules/mapping_facts.py for 100 to 100k adapters/VTDs, runs the
+vscsi, npiv, suspend and cluster parsers on it under a fake module and a
+fake lsmap process, and records wall time and peak memory.
+
+Wall times depend on the machine, so each one is also reported relative to
+the time of splitting the same lines into stripped fields, the minimum
+work of any parser, measured in the same process. The relative times and
+the peak memory are compared to a stored baseline and the script exits
+with rc=1 if one of them regresses past the allowed tolerance.
+
+No VIOS is needed, only ansible-core and the collection checked out as
+ansible_collections/ibm/power_vios to import the module and its module_utils.
+
+usage:
+    python devops/bin/mapping_facts_benchmark.py
+    python devops/bin/mapping_facts_benchmark.py --sizes 100 1000 --components vscsi npiv
+    python devops/bin/mapping_facts_benchmark.py --update-baseline
+"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import argparse
+import gc
+import importlib.util
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+BIN_DIR = os.path.dirname(os.path.abspath(__file__))
+MODULE_PATH = os.path.join(BIN_DIR, '..', '..', 'plugins', 'modules', 'mapping_facts.py')
+BASELINE_PATH = os.path.join(BIN_DIR, 'mapping_facts_benchmark.json')
+# Directory containing ansible_collections/ibm/power_vios
+COLLECTIONS_DIR = os.path.normpath(os.path.join(BIN_DIR, '..', '..', '..', '..', '..'))
+
+SIZES = [100, 1000, 10000, 100000]
+COMPONENTS = ['vscsi', 'npiv', 'suspend', 'cluster']
+VTDS_PER_ADAPTER = 2
+CLUSTER_NAME = 'benchcluster'
+
+# Regressions smaller than these are measurement noise
+TIME_SLACK = 0.005  # seconds, shorter runs are not compared
+RELATIVE_SLACK = 0.5
+MEMORY_SLACK = 64  # KiB
+
+
+####################################################################################
+# lsmap output generators
+####################################################################################
+
+
+def vtd_fields(index):
+    """
+    Fields of a virtual target device: vtd:status:lun:backing:bdphysloc:mirrored
+    """
+    return ['vtscsi%d' % index, 'Available', '0x%x000000000000' % (0x8100 + index % 0xff),
+            'hdisk%d' % index, 'U78CD.001.FZH1998-P1-C6-T2-W500507680B215660-L%x' % index, 'false']
+
+
+def gen_vscsi(size):
+    """
+    svsa:physloc:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
+    """
+    for adapter in range(size // VTDS_PER_ADAPTER):
+        fields = ['vhost%d' % adapter, 'U8284.22A.21FD4BV-V1-C%d' % adapter, '0x%08x' % (adapter % 1000)]
+        for vtd in range(VTDS_PER_ADAPTER):
+            fields += vtd_fields(adapter * VTDS_PER_ADAPTER + vtd)
+        yield ','.join(fields) + '\n'
+
+
+def gen_npiv(size):
+    """
+    name:physloc:clntid:clntname:clntos:status:fc:fcphysloc:ports:flags:vfcclient:vfcclientdrc
+    """
+    for adapter in range(size):
+        client = adapter % 1000
+        yield ','.join(['vfchost%d' % adapter, 'U8284.22A.21FD4BV-V1-C%d' % adapter, str(client),
+                        'lpar%d' % client, 'AIX', 'LOGGED_IN', 'fcs%d' % (adapter % 8),
+                        'U78CD.001.FZH1998-P1-C6-T%d' % (adapter % 8), '3', 'a', 'fcs0',
+                        'U8284.22A.21FD4BV-V%d-C3' % client]) + '\n'
+
+
+def gen_suspend(size):
+    """
+    svsa:state:clientname:streamid:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
+    """
+    for adapter in range(size // VTDS_PER_ADAPTER):
+        fields = ['susadpt%d' % adapter, 'suspended', '%d*9117-MMB*10002EP' % adapter,
+                  '0x%016x' % adapter, '0x%08x' % (adapter % 1000)]
+        for vtd in range(VTDS_PER_ADAPTER):
+            fields += vtd_fields(adapter * VTDS_PER_ADAPTER + vtd)
+        yield ','.join(fields) + '\n'
+
+
+def gen_cluster(size):
+    """
+    physloc:clientid:vtd:lun:backing
+    """
+    for vtd in range(size):
+        adapter = vtd // VTDS_PER_ADAPTER
+        yield ','.join(['U8233.E8B.HV32001-V2-C%d' % adapter, '0x%08x' % (adapter % 1000), 'vtscsi%d' % vtd,
+                        '0x%x000000000000' % (0x8100 + vtd % 0xff),
+                        'LU%d.b1277fffdd5f38acb365413b55e51638' % vtd]) + '\n'
+
+
+GENERATORS = {
+    'vscsi': gen_vscsi,
+    'npiv': gen_npiv,
+    'suspend': gen_suspend,
+    'cluster': gen_cluster,
+}
+
+
+####################################################################################
+# Fakes
+####################################################################################
+
+
+class FakeStdout(object):
+    """
+    Stdout of the fake lsmap process, produces the lines on demand.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        return (line.encode('utf-8') for line in self.lines)
+
+    def close(self):
+        pass
+
+
+class FakeProcess(object):
+    """
+    Fake lsmap process streaming the generated output.
+    """
+
+    def __init__(self, lines):
+        self.stdout = FakeStdout(lines)
+
+    def wait(self):
+        return 0
+
+
+class FakeSubprocess(object):
+    """
+    Replaces the subprocess module used by module_utils/lsmap.py to run lsmap.
+    """
+    PIPE = -1
+
+    def __init__(self, component, size):
+        self.component = component
+        self.size = size
+
+    def Popen(self, cmd, **kwargs):
+        return FakeProcess(GENERATORS[self.component](self.size))
+
+
+class ModuleFailed(Exception):
+    pass
+
+
+class FakeModule(object):
+    """
+    Fake AnsibleModule, run_command only answers the cluster listing.
+    """
+
+    run_command_environ_update = {}
+
+    def __init__(self, component):
+        self.params = dict(component=component, vadapter=None, physloc=None, vtd=None,
+                           hostname=None, cluster_nodes=False, cpid=None, types=None,
+                           fields=None, gather_subset=None, workers=1, stats=False)
+
+    def run_command(self, cmd, **kwargs):
+        if 'cluster' in cmd and '-list' in cmd:
+            return 0, CLUSTER_NAME + '\n', ''
+        raise ModuleFailed('Unexpected command: %s' % ' '.join(cmd))
+
+    def fail_json(self, **kwargs):
+        raise ModuleFailed(kwargs.get('msg'))
+
+    def warn(self, msg):
+        pass
+
+
+####################################################################################
+# Benchmark
+####################################################################################
+
+
+def load_module():
+    """
+    Import plugins/modules/mapping_facts.py.
+    """
+    if COLLECTIONS_DIR not in sys.path:
+        sys.path.insert(0, COLLECTIONS_DIR)
+    spec = importlib.util.spec_from_file_location('mapping_facts', MODULE_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def count_records(component, mappings):
+    """
+    Return the number of VTDs (or adapters for npiv) parsed.
+    """
+    adapters = mappings[component]
+    if component == 'cluster':
+        adapters = adapters[CLUSTER_NAME]
+    if component == 'npiv':
+        return len(adapters)
+    return sum(len(adapter['vtds']) for adapter in adapters.values())
+
+
+def run_parser(mapping_facts, component, size):
+    """
+    Run the parser of a component on generated output, return the mappings.
+    """
+    # lsmap is run by the module_utils imported by mapping_facts
+    sys.modules[mapping_facts.stream_lsmap.__module__].subprocess = FakeSubprocess(component, size)
+    mappings = {}
+    getattr(mapping_facts, component + '_mappings')(FakeModule(component), mappings)
+    return mappings
+
+
+def split_lines(component, size):
+    """
+    Split the generated lines into stripped fields, the calibration workload.
+    """
+    for line in GENERATORS[component](size):
+        [field.strip() for field in line.split(',')]
+
+
+def median_time(function, repeat):
+    """
+    Return the median wall time of repeat calls of function.
+    """
+    times = []
+    for dummy in range(repeat):
+        gc.collect()
+        gc.disable()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+        gc.enable()
+    return statistics.median(times)
+
+
+def measure(mapping_facts, component, size, repeat):
+    """
+    Return the median wall time over repeat runs, the same time relative to
+    the calibration workload and the peak memory of one run.
+    """
+    mappings = run_parser(mapping_facts, component, size)
+    expected = size - size % VTDS_PER_ADAPTER if component in ('vscsi', 'suspend') else size
+    if count_records(component, mappings) != expected:
+        raise ModuleFailed('%s parser returned %d records instead of %d'
+                           % (component, count_records(component, mappings), expected))
+    del mappings
+
+    wall_time = median_time(lambda: run_parser(mapping_facts, component, size), repeat)
+    calibration = median_time(lambda: split_lines(component, size), repeat)
+
+    tracemalloc.start()
+    run_parser(mapping_facts, component, size)
+    dummy, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return dict(time=round(wall_time, 4), relative=round(wall_time / calibration, 2), peak_kb=peak // 1024)
+
+
+def compare(results, baseline, time_tolerance, memory_tolerance):
+    """
+    Return the list of regressions of results compared to baseline.
+    """
+    regressions = []
+    for component, sizes in results.items():
+        for size, result in sizes.items():
+            reference = baseline.get(component, {}).get(size)
+            if not reference:
+                continue
+            if result['time'] >= TIME_SLACK and 'relative' in reference \
+                    and result['relative'] > reference['relative'] * time_tolerance + RELATIVE_SLACK:
+                regressions.append('%s %s: relative time %.2f > baseline %.2f x %.2f'
+                                   % (component, size, result['relative'], reference['relative'], time_tolerance))
+            if result['peak_kb'] > reference['peak_kb'] * memory_tolerance + MEMORY_SLACK:
+                regressions.append('%s %s: peak memory %dKiB > baseline %dKiB x %.2f'
+                                   % (component, size, result['peak_kb'], reference['peak_kb'], memory_tolerance))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the mapping_facts lsmap parsers.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES,
+                        help='number of adapters/VTDs to generate (default: %(default)s)')
+    parser.add_argument('--components', nargs='+', choices=COMPONENTS, default=COMPONENTS,
+                        help='parsers to benchmark (default: all)')
+    parser.add_argument('--repeat', type=int, default=7,
+                        help='runs per measure, the median time is kept (default: %(default)s)')
+    parser.add_argument('--baseline', default=BASELINE_PATH,
+                        help='baseline file (default: %(default)s)')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline instead of comparing')
+    parser.add_argument('--time-tolerance', type=float, default=2.0,
+                        help='allowed relative time ratio to the baseline (default: %(default)s)')
+    parser.add_argument('--memory-tolerance', type=float, default=1.2,
+                        help='allowed peak memory ratio to the baseline (default: %(default)s)')
+    args = parser.parse_args()
+
+    mapping_facts = load_module()
+
+    results = {}
+    print('%-10s %8s %10s %10s %12s' % ('parser', 'size', 'time (s)', 'relative', 'peak (KiB)'))
+    for component in args.components:
+        results[component] = {}
+        for size in args.sizes:
+            result = measure(mapping_facts, component, size, args.repeat)
+            results[component][str(size)] = result
+            print('%-10s %8d %10.4f %10.2f %12d' % (component, size, result['time'], result['relative'], result['peak_kb']))
+
+    if args.update_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline, 'r') as baseline_file:
+                baseline = json.load(baseline_file)
+        for component, sizes in results.items():
+            baseline.setdefault(component, {}).update(sizes)
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(baseline, baseline_file, indent=4, sort_keys=True)
+            baseline_file.write('\n')
+        print('Baseline updated: %s' % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print('No baseline found at %s, run with --update-baseline to create it.' % args.baseline)
+        return 0
+    with open(args.baseline, 'r') as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regressions = compare(results, baseline, args.time_tolerance, args.memory_tolerance)
+    for regression in regressions:
+        print('REGRESSION: ' + regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+name: npiv_placement
+author:
+- AIX Development Team (@pbfinley1911)
+short_description: Plans the moves of virtual fibre channel adapters that balance the physical ports
+description:
+- Takes the I(mappings) facts gathered by M(ibm.power_vios.mapping_facts) and the I(fcports)
+  facts gathered by M(ibm.power_vios.fcport_facts) on a VIOS and returns a plan of C(vfchost)
+  moves between physical fibre channel ports that lowers the load of the busiest port.
+- Only facts are used, so the plan can be computed offline from recorded fact files.
+- The load of a C(vfchost) is taken from I(loads) when set. Otherwise the load of its physical
+  port is split evenly between the logged in C(vfchost) adapters mapped to the port.
+- A C(vfchost) is only moved to a port of the same fabric, that is in the I(fcports) facts,
+  supports NPIV and has fewer than its maximum number of logins.
+- A port is known to support NPIV when C(vfchost) adapters are mapped to it, from the facts of
+  the mappings gathered with I(enrich=npiv), or from I(port_attributes). A port without
+  C(vfchost) adapters is never the target of a move unless I(port_attributes) sets its I(fabric).
+- The best reachable peak load is first computed with a longest processing time first
+  bin-packing of all the C(vfchost) adapters. Then, starting from the current placement, the
+  C(vfchost) move that lowers the busiest port the most is applied until the peak load is within
+  I(tolerance) of that target, so that only the moves that are needed are planned.
+options:
+  _input:
+    description: The I(mappings) facts of the VIOS, in the C(nested) format.
+    type: dict
+    required: true
+  fcports:
+    description: The I(fcports) facts of the VIOS.
+    type: dict
+    required: true
+  metric:
+    description: The port load to balance.
+    type: str
+    choices: [mbps, frames_per_sec, iops]
+    default: mbps
+  loads:
+    description:
+    - Maps C(vfchost) name to its load, for instance measured from the client partitions.
+    - The port load that is not accounted for by its C(vfchost) adapters is kept on the port.
+    type: dict
+  fabrics:
+    description:
+    - Maps physical port name to the name of its fabric.
+    - If not set, all the ports are assumed to be attached to the same fabric.
+    - A port that is not listed is considered alone on its fabric.
+    type: dict
+  max_logins:
+    description:
+    - The maximum number of C(vfchost) adapters that can be mapped to a port.
+    - If not set, the NPIV capacity of the port is taken from I(port_attributes) or from the
+      mappings gathered with I(enrich=npiv), the number of C(vfchost) adapters is not limited otherwise.
+    type: int
+  port_attributes:
+    description:
+    - Maps physical port name to its NPIV attributes, as returned by C(lsnports).
+    - I(fabric) is whether the port is attached to a fabric that supports NPIV, I(tports) its
+      maximum number of C(vfchost) adapters.
+    - Use it to make the ports without C(vfchost) adapters targets of the moves.
+    type: dict
+  tolerance:
+    description: The peak load, relative to the best reachable one, that is accepted without moves.
+    type: float
+    default: 0.1
+  max_moves:
+    description: The maximum number of C(vfchost) moves to plan.
+    type: int
+notes:
+- Moving a C(vfchost) takes the paths of its client partition through this VIOS offline until
+  the client logs in again on the new port. Check that the client partitions have a path through
+  the other VIOS with the ibm.power_vios.vios_redundancy filter before applying the plan.
+'''
+
+EXAMPLES = r'''
+- name: Plan the rebalancing of the NPIV clients from recorded facts
+  debug:
+    msg: "{{ (lookup('file', 'facts/vios1_mappings.json') | from_json)
+             | ibm.power_vios.npiv_placement(lookup('file', 'facts/vios1_fcports.json') | from_json,
+                                              fabrics={'fcs0': 'A', 'fcs1': 'B', 'fcs2': 'A', 'fcs3': 'B'}) }}"
+
+- name: Plan at most two moves with the gathered facts
+  set_fact:
+    npiv_plan: "{{ ansible_facts.mappings | ibm.power_vios.npiv_placement(ansible_facts.fcports, max_moves=2) }}"
+'''
+
+RETURN = r'''
+_value:
+  description:
+  - I(moves) is the list of C(vfchost) moves with the C(vfcmap) commands that apply them.
+  - I(ports) has for each physical port its fabric, login capacity, load and number of C(vfchost)
+    adapters before and after the moves.
+  - I(peak_before) and I(peak_after) are the load of the busiest port before and after the moves,
+    I(target) the peak load of the bin-packing placement.
+  type: dict
+  sample:
+    {
+        "moves": [
+            {"adapter": "vfchost3", "clientid": 12, "clntname": "lpar12", "fabric": "A",
+             "from": "fcs0", "to": "fcs2", "load": 180.5,
+             "commands": ["vfcmap -vadapter vfchost3 -fcp", "vfcmap -vadapter vfchost3 -fcp fcs2"]}
+        ],
+        "ports": {
+            "fcs0": {"fabric": "A", "capacity": 64, "before": 410.2, "after": 229.7,
+                     "vfchosts_before": 3, "vfchosts_after": 2},
+            "fcs2": {"fabric": "A", "capacity": 64, "before": 12.0, "after": 192.5,
+                     "vfchosts_before": 1, "vfchosts_after": 2}
+        },
+        "peak_before": 410.2,
+        "peak_after": 229.7,
+        "target": 229.7
+    }
+'''
+
+from ansible.errors import AnsibleFilterError
+
+
+def port_capacity(adapters, attributes, max_logins):
+    """
+    Return the maximum number of vfchost adapters of a port, None if not limited.
+    """
+    if max_logins is not None:
+        return max_logins
+    if 'tports' in attributes:
+        return attributes['tports']
+    for mapping in adapters:
+        if 'tports' in mapping.get('fcport', {}):
+            return mapping['fcport']['tports']
+    return None
+
+
+def npiv_capable(adapters, attributes):
+    """
+    Return whether a port is attached to a fabric that supports NPIV, as far as the facts tell.
+    A port whose capability is unknown is not.
+    """
+    if 'fabric' in attributes:
+        return bool(attributes['fabric'])
+    for mapping in adapters:
+        if 'fabric' in mapping.get('fcport', {}):
+            return mapping['fcport']['fabric']
+    # vfcmap only maps vfchost adapters to ports that support NPIV
+    return bool(adapters)
+
+
+def lpt_peak(items, base, capacity):
+    """
+    Return the peak port load of the longest processing time first placement of the items.
+    """
+    load = dict(base)
+    count = dict((port, 0) for port in base)
+    for item in sorted(items, key=lambda item: (-item['load'], item['adapter'])):
+        ports = [port for port in load if capacity[port] is None or count[port] < capacity[port]]
+        port = min(ports, key=lambda port: (load[port], port)) if ports else item['port']
+        load[port] += item['load']
+        count[port] += 1
+    return max(load.values())
+
+
+def plan_fabric(items, base, capacity, tolerance, max_moves):
+    """
+    Move the items of the busiest port until its load is within tolerance of the best reachable
+    peak load. Return the target peak load, items are updated with their new port.
+    """
+    target = lpt_peak(items, base, capacity)
+    load = dict(base)
+    count = dict((port, 0) for port in base)
+    for item in items:
+        load[item['port']] += item['load']
+        count[item['port']] += 1
+
+    moved = set()
+    for _ in range(len(items) * len(base)):
+        if max_moves is not None and len(moved) >= max_moves:
+            break
+        source = max(load, key=lambda port: (load[port], port))
+        peak = load[source]
+        if peak <= target * (1 + tolerance):
+            break
+        best = None
+        for item in items:
+            if item['port'] != source or item['load'] <= 0:
+                continue
+            for port in load:
+                if port == source or (capacity[port] is not None and count[port] >= capacity[port]):
+                    continue
+                new_peak = max(peak - item['load'], load[port] + item['load'])
+                if new_peak < peak and (best is None or (new_peak, item['adapter'], port) < best[:3]):
+                    best = (new_peak, item['adapter'], port, item)
+        if best is None:
+            break
+        port, item = best[2], best[3]
+        load[source] -= item['load']
+        count[source] -= 1
+        load[port] += item['load']
+        count[port] += 1
+        item['port'] = port
+        moved.add(item['adapter'])
+    return target
+
+
+def npiv_placement(mappings, fcports, metric='mbps', loads=None, fabrics=None, max_logins=None,
+                   tolerance=0.1, max_moves=None, port_attributes=None):
+    """
+    Plan the vfchost moves that balance the load of the physical fibre channel ports.
+    """
+    if not isinstance(mappings, dict) or not isinstance(fcports, dict):
+        raise AnsibleFilterError('npiv_placement expects the mappings and fcports facts of a VIOS')
+    if metric not in ('mbps', 'frames_per_sec', 'iops'):
+        raise AnsibleFilterError(f'npiv_placement: unsupported metric {metric}')
+    if tolerance < 0:
+        raise AnsibleFilterError('npiv_placement: tolerance must not be negative')
+    loads = loads or {}
+    port_attributes = port_attributes or {}
+
+    # vfchost adapters mapped to each port
+    mapped = dict((port, []) for port in fcports)
+    for adapter, mapping in mappings.get('npiv', {}).items():
+        if mapping.get('fc'):
+            mapped.setdefault(mapping['fc'], []).append(dict(mapping, adapter=adapter))
+
+    items = []
+    ports = {}
+    for port in sorted(mapped):
+        adapters = mapped[port]
+        port_load = fcports.get(port, {}).get(metric, 0.0)
+        if loads:
+            adapter_loads = dict((mapping['adapter'], float(loads.get(mapping['adapter'], 0.0))) for mapping in adapters)
+        else:
+            logged_in = [mapping['adapter'] for mapping in adapters if mapping.get('status', 'LOGGED_IN') == 'LOGGED_IN']
+            adapter_loads = dict((adapter, port_load / len(logged_in) if adapter in logged_in else 0.0)
+                                 for adapter in (mapping['adapter'] for mapping in adapters))
+        fabric = port if fabrics and port not in fabrics else (fabrics or {}).get(port, 'default')
+        attributes = port_attributes.get(port, {})
+        ports[port] = dict(fabric=fabric, capacity=port_capacity(adapters, attributes, max_logins),
+                           base=max(port_load - sum(adapter_loads.values()), 0.0),
+                           npiv=npiv_capable(adapters, attributes), vfchosts_before=len(adapters))
+        for mapping in adapters:
+            items.append(dict(adapter=mapping['adapter'], clientid=mapping.get('clntid'), clntname=mapping.get('clntname'),
+                              load=adapter_loads[mapping['adapter']], port=port, origin=port, fabric=fabric))
+
+    target = 0.0
+    planned = set()
+    for fabric in sorted(set(port['fabric'] for port in ports.values())):
+        fabric_ports = [port for port in ports if ports[port]['fabric'] == fabric and ports[port]['npiv']]
+        fabric_items = [item for item in items if item['port'] in fabric_ports]
+        if len(fabric_ports) < 2 or not fabric_items:
+            continue
+        planned.update(fabric_ports)
+        budget = None
+        if max_moves is not None:
+            budget = max_moves - sum(1 for item in items if item['port'] != item['origin'])
+        target = max(target, plan_fabric(fabric_items, dict((port, ports[port]['base']) for port in fabric_ports),
+                                         dict((port, ports[port]['capacity']) for port in fabric_ports),
+                                         tolerance, budget))
+
+    report = dict(moves=[], ports={})
+    for port, info in ports.items():
+        report['ports'][port] = dict(fabric=info['fabric'], capacity=info['capacity'], before=info['base'], after=info['base'],
+                                     vfchosts_before=info['vfchosts_before'], vfchosts_after=0)
+    for item in items:
+        report['ports'][item['origin']]['before'] += item['load']
+        report['ports'][item['port']]['after'] += item['load']
+        report['ports'][item['port']]['vfchosts_after'] += 1
+        if item['port'] != item['origin']:
+            move = dict(adapter=item['adapter'], clientid=item['clientid'], clntname=item['clntname'], fabric=item['fabric'])
+            move['from'] = item['origin']
+            move['to'] = item['port']
+            move['load'] = round(item['load'], 2)
+            move['commands'] = [f"vfcmap -vadapter {item['adapter']} -fcp", f"vfcmap -vadapter {item['adapter']} -fcp {item['port']}"]
+            report['moves'].append(move)
+    for info in report['ports'].values():
+        info['before'] = round(info['before'], 2)
+        info['after'] = round(info['after'], 2)
+    report['moves'].sort(key=lambda move: (move['from'], -move['load'], move['adapter']))
+    report['peak_before'] = max([info['before'] for info in report['ports'].values()] or [0.0])
+    report['peak_after'] = max([info['after'] for info in report['ports'].values()] or [0.0])
+    report['target'] = round(max([target] + [info['after'] for port, info in report['ports'].items() if port not in planned]), 2)
+    return report
+
+
+class FilterModule(object):
+    """
+    NPIV placement filters.
+    """
+
+    def filters(self):
+        return {
+            'npiv_placement': npiv_placement,
+        }
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+name: sea_vlan_balance
+author:
+- AIX Development Team (@pbfinley1911)
+short_description: Proposes a VLAN distribution that balances the traffic of a load sharing SEA pair
+description:
+- Takes the I(seas) facts gathered by M(ibm.power_vios.sea_facts) on the two VIOS of a shared
+  Ethernet adapter (SEA) pair in load sharing mode and the traffic of each VLAN, and proposes VLAN
+  moves between trunk adapters that balance the bytes per second bridged by each VIOS.
+- Only facts are used, so the proposal can be computed offline from recorded data.
+- The trunk adapters of both VIOS are paired on their port VLAN ID. A trunk adapter pair is
+  bridged by the VIOS where its trunk adapter is active, so its VLANs are carried by that VIOS.
+- The port VLAN ID of a trunk adapter cannot be moved. Starting from the current distribution,
+  the tagged VLAN whose move to the least loaded trunk adapter of the other VIOS best reduces the
+  imbalance is moved, until the imbalance is within I(tolerance).
+options:
+  _input:
+    description: The I(seas) facts of the first VIOS.
+    type: dict
+    required: true
+  other:
+    description: The I(seas) facts of the second VIOS.
+    type: dict
+    required: true
+  vlan_loads:
+    description:
+    - Maps VLAN ID to its traffic in bytes per second, for instance computed from two samples
+      of the seastat per-VLAN statistics.
+    - A list of such dicts, one per VIOS, is added up.
+    type: raw
+    required: true
+  sea:
+    description:
+    - The name of the SEA on the first VIOS.
+    - Required if the facts have several SEAs.
+    type: str
+  other_sea:
+    description: The name of the SEA on the second VIOS, I(sea) by default.
+    type: str
+  names:
+    description: The two distinct names of the VIOS, used in the report.
+    type: list
+    elements: str
+    default: [vios1, vios2]
+  tolerance:
+    description: The imbalance, as a fraction of the total traffic, that is accepted without moves.
+    type: float
+    default: 0.05
+  max_moves:
+    description: The maximum number of VLAN moves to propose.
+    type: int
+  max_vlans:
+    description: The maximum number of VLAN IDs of a trunk adapter, port VLAN ID included.
+    type: int
+    default: 20
+'''
+
+EXAMPLES = r'''
+- name: Propose a VLAN distribution from recorded data
+  debug:
+    msg: "{{ (lookup('file', 'facts/vios1_seas.json') | from_json)
+             | ibm.power_vios.sea_vlan_balance(lookup('file', 'facts/vios2_seas.json') | from_json,
+                                                lookup('file', 'facts/vlan_loads.json') | from_json,
+                                                sea='ent8', names=['vios1', 'vios2']) }}"
+'''
+
+RETURN = r'''
+_value:
+  description:
+  - I(moves) is the list of VLAN moves between trunk adapters, named after the first VIOS.
+  - I(trunks) has for each trunk adapter pair, keyed by the name of the trunk adapter on the
+    first VIOS, its name on the second VIOS, port VLAN ID, the VIOS where it is active and its
+    VLANs and load before and after the moves.
+  - I(before) and I(after) have the bytes per second bridged by each VIOS and the I(imbalance),
+    the difference between both VIOS as a fraction of the total traffic.
+  - I(mismatched) lists the trunk adapters that are not configured the same on both VIOS, they are
+    left out of the proposal.
+  type: dict
+  sample:
+    {
+        "moves": [
+            {"vlan": 30, "load": 41943040.0, "from": "ent6", "to": "ent7",
+             "from_vios": "vios1", "to_vios": "vios2"}
+        ],
+        "trunks": {
+            "ent6": {"other": "ent6", "pvid": 99, "active": "vios1", "vlans_before": [10, 20, 30],
+                     "vlans_after": [10, 20], "load_before": 104857600.0, "load_after": 62914560.0},
+            "ent7": {"other": "ent7", "pvid": 98, "active": "vios2", "vlans_before": [40],
+                     "vlans_after": [30, 40], "load_before": 20971520.0, "load_after": 62914560.0}
+        },
+        "before": {"vios1": 104857600.0, "vios2": 20971520.0, "imbalance": 0.667},
+        "after": {"vios1": 62914560.0, "vios2": 62914560.0, "imbalance": 0.0},
+        "mismatched": []
+    }
+'''
+
+from ansible.errors import AnsibleFilterError
+
+
+def select_sea(seas, name):
+    """
+    Return the facts of the SEA of a VIOS.
+    """
+    if name is None:
+        if len(seas) != 1:
+            raise AnsibleFilterError('sea_vlan_balance: sea is required when the facts have several SEAs')
+        name = list(seas)[0]
+    if name not in seas:
+        raise AnsibleFilterError(f'sea_vlan_balance: no SEA {name} in the facts')
+    return seas[name]
+
+
+def trunk_adapters(sea):
+    """
+    Return the trunk adapters of a SEA keyed by port VLAN ID.
+    """
+    trunks = {}
+    for adapter, info in sea.get('adapters', {}).items():
+        if info.get('role') == 'virtual' and info.get('trunk', True) and 'pvid' in info:
+            trunks[info['pvid']] = dict(info, name=adapter)
+    return trunks
+
+
+def total_loads(vlan_loads):
+    """
+    Return the VLAN loads keyed by integer VLAN ID, added up over the VIOS.
+    """
+    if isinstance(vlan_loads, dict):
+        vlan_loads = [vlan_loads]
+    if not isinstance(vlan_loads, list):
+        raise AnsibleFilterError('sea_vlan_balance: vlan_loads must be a dict or a list of dicts')
+    loads = {}
+    for sample in vlan_loads:
+        for vlan, load in sample.items():
+            loads[int(vlan)] = loads.get(int(vlan), 0.0) + float(load)
+    return loads
+
+
+def imbalance(sides):
+    """
+    Return the difference between the two sides as a fraction of the total.
+    """
+    total = sum(sides)
+    return round(abs(sides[0] - sides[1]) / total, 3) if total else 0.0
+
+
+def sea_vlan_balance(seas, other, vlan_loads, sea=None, other_sea=None, names=None, tolerance=0.05,
+                     max_moves=None, max_vlans=20):
+    """
+    Propose the VLAN moves that balance the traffic of the two SEAs of a load sharing pair.
+    """
+    if not isinstance(seas, dict) or not isinstance(other, dict):
+        raise AnsibleFilterError('sea_vlan_balance expects the seas facts of two VIOS')
+    names = list(names or ['vios1', 'vios2'])
+    if len(names) != 2 or names[0] == names[1]:
+        raise AnsibleFilterError('sea_vlan_balance expects two distinct VIOS names')
+    loads = total_loads(vlan_loads)
+    pair = [trunk_adapters(select_sea(seas, sea)), trunk_adapters(select_sea(other, other_sea or sea))]
+
+    trunks = {}
+    mismatched = []
+    for pvid in sorted(set(pair[0]) | set(pair[1])):
+        first, second = pair[0].get(pvid), pair[1].get(pvid)
+        if first is None or second is None or sorted(first.get('vlans', [])) != sorted(second.get('vlans', [])):
+            mismatched.append((first or second)['name'])
+            continue
+        if first.get('active'):
+            side = 0
+        elif second.get('active'):
+            side = 1
+        else:
+            continue  # Not bridged by any VIOS
+        trunks[first['name']] = dict(other=second['name'], pvid=pvid, side=side,
+                                     vlans=sorted(vlan for vlan in first.get('vlans', []) if vlan != pvid))
+
+    def trunk_load(trunk):
+        return loads.get(trunk['pvid'], 0.0) + sum(loads.get(vlan, 0.0) for vlan in trunk['vlans'])
+
+    before = dict((name, dict(trunk, vlans=list(trunk['vlans']), load=trunk_load(trunk))) for name, trunk in trunks.items())
+    sides = [0.0, 0.0]
+    for trunk in before.values():
+        sides[trunk['side']] += trunk['load']
+    sides_before = list(sides)
+
+    moves = []
+    while max_moves is None or len(moves) < max_moves:
+        if imbalance(sides) <= tolerance:
+            break
+        heavy = 0 if sides[0] > sides[1] else 1
+        difference = sides[heavy] - sides[1 - heavy]
+        targets = [name for name, trunk in trunks.items()
+                   if trunk['side'] == 1 - heavy and len(trunk['vlans']) + 1 < max_vlans]
+        if not targets:
+            break
+        target = min(targets, key=lambda name: (trunk_load(trunks[name]), name))
+        best = None
+        for name, trunk in trunks.items():
+            if trunk['side'] != heavy:
+                continue
+            for vlan in trunk['vlans']:
+                load = loads.get(vlan, 0.0)
+                # Moving the VLAN changes the difference by twice its load
+                remaining = abs(difference - 2 * load)
+                if load > 0 and remaining < difference and (best is None or (remaining, vlan) < best[:2]):
+                    best = (remaining, vlan, name)
+        if best is None:
+            break
+        vlan, source = best[1], best[2]
+        trunks[source]['vlans'].remove(vlan)
+        trunks[target]['vlans'] = sorted(trunks[target]['vlans'] + [vlan])
+        sides[heavy] -= loads[vlan]
+        sides[1 - heavy] += loads[vlan]
+        move = dict(vlan=vlan, load=round(loads[vlan], 1))
+        move['from'] = source
+        move['to'] = target
+        move['from_vios'] = names[heavy]
+        move['to_vios'] = names[1 - heavy]
+        moves.append(move)
+
+    report = dict(moves=moves, trunks={}, mismatched=mismatched)
+    for name, trunk in trunks.items():
+        report['trunks'][name] = dict(other=trunk['other'], pvid=trunk['pvid'], active=names[trunk['side']],
+                                      vlans_before=before[name]['vlans'], vlans_after=trunk['vlans'],
+                                      load_before=round(before[name]['load'], 1), load_after=round(trunk_load(trunk), 1))
+    report['before'] = {names[0]: round(sides_before[0], 1), names[1]: round(sides_before[1], 1),
+                        'imbalance': imbalance(sides_before)}
+    report['after'] = {names[0]: round(sides[0], 1), names[1]: round(sides[1], 1), 'imbalance': imbalance(sides)}
+    return report
+
+
+class FilterModule(object):
+    """
+    SEA load sharing filters.
+    """
+
+    def filters(self):
+        return {
+            'sea_vlan_balance': sea_vlan_balance,
+        }
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+name: vios_redundancy
+author:
+- AIX Development Team (@pbfinley1911)
+short_description: Reports the client partitions that are not served by both VIOS of a pair
+description:
+- Takes the I(mappings) facts gathered by M(ibm.power_vios.mapping_facts) on the two VIOS
+  of a redundant pair and reports the client partitions that only have a path through one of them.
+- The mappings of both VIOS are hash-joined so the analysis is linear in the number of mappings.
+- C(vscsi) virtual target devices are joined on client partition ID and backing disk identity. The
+  identity is the unique ID or PVID of the backing device, from mappings gathered with
+  I(enrich=backing), or the name of shared storage pool logical units. Virtual target devices whose
+  backing has no such identity, and those of the same client partition on the other VIOS, cannot be
+  verified and are reported as I(unverifiable) rather than single-pathed.
+- C(npiv) client partitions are joined on client partition ID, only logged in adapters are paths.
+- C(vnic) client adapters are joined on client partition ID and client adapter location code.
+- C(net) reports the VIOS that is the only one of the pair with an available shared Ethernet adapter,
+  as the mappings do not contain client partition information. Nothing is reported when neither VIOS
+  has one, as in a storage-only VIOS pair, or when the C(net) mappings of a VIOS were not gathered.
+options:
+  _input:
+    description: The I(mappings) facts of the first VIOS.
+    type: dict
+    required: true
+  other:
+    description: The I(mappings) facts of the second VIOS.
+    type: dict
+    required: true
+  names:
+    description: The names of the two VIOS, used in the report.
+    type: list
+    elements: str
+    default: [vios1, vios2]
+'''
+
+EXAMPLES = r'''
+- name: Report the client partitions that are not served by both VIOS
+  debug:
+    msg: "{{ hostvars['vios1'].ansible_facts.mappings
+             | ibm.power_vios.vios_redundancy(hostvars['vios2'].ansible_facts.mappings, names=['vios1', 'vios2']) }}"
+'''
+
+RETURN = r'''
+_value:
+  description:
+  - For each of C(vscsi), C(npiv) and C(vnic), the mappings found on one VIOS only in
+    I(single_pathed) and the IDs of the affected client partitions in I(clients).
+  - For C(vscsi), the virtual target devices that cannot be matched in I(unverifiable) and
+    the IDs of their client partitions in I(unverifiable_clients).
+  - For C(net), the VIOS that is the only one with an available shared Ethernet adapter in I(single_pathed).
+  - I(single_pathed_clients) is the sorted list of all the affected client partition IDs.
+  type: dict
+  sample:
+    {
+        "vscsi": {
+            "clients": [19],
+            "single_pathed": [
+                {"clientid": 19, "vios": "vios1", "adapter": "vhost0", "vtd": "vtscsi0",
+                 "backing": "hdisk4", "disk": "332136005076300818045C800000000000A2D04214503IBMfcp"}
+            ],
+            "unverifiable": [
+                {"clientid": 21, "vios": "vios2", "adapter": "vhost2", "vtd": "vtscsi5",
+                 "backing": "lv_client21", "disk": null}
+            ],
+            "unverifiable_clients": [21]
+        },
+        "npiv": {"clients": [], "single_pathed": []},
+        "vnic": {"clients": [], "single_pathed": []},
+        "net": {"single_pathed": []},
+        "single_pathed_clients": [19]
+    }
+'''
+
+from ansible.errors import AnsibleFilterError
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import is_lu_backing
+
+
+def client_key(clientid):
+    """
+    Sort key of client partition IDs, numerically with missing IDs last.
+    """
+    return (clientid is None, clientid if clientid is not None else 0)
+
+
+def disk_identity(record):
+    """
+    Return the identity of the backing device of a virtual target device,
+    that is the same when seen from both VIOS, or None if it is not known.
+    """
+    attributes = record.get('attributes', {})
+    for key in ('unique_id', 'pvid'):
+        if attributes.get(key):
+            return attributes[key]
+    backing = record.get('backing')
+    if backing and is_lu_backing(backing):
+        return backing
+    return None
+
+
+def vscsi_paths(mappings):
+    """
+    Return the VSCSI paths keyed by (client ID, disk identity) and the list
+    of paths whose disk identity is not known.
+    """
+    paths = {}
+    unknown = []
+    for adapter, mapping in mappings.get('vscsi', {}).items():
+        for vtd, record in mapping.get('vtds', {}).items():
+            if not record.get('backing'):
+                continue  # Nothing to serve, for instance an empty optical device
+            disk = disk_identity(record)
+            path = dict(clientid=mapping.get('clientid'), adapter=adapter, vtd=vtd,
+                        backing=record.get('backing'), disk=disk)
+            if disk is None:
+                unknown.append(path)
+            else:
+                paths[(mapping.get('clientid'), disk)] = path
+    return paths, unknown
+
+
+def npiv_paths(mappings):
+    """
+    Return the logged in NPIV paths keyed by client ID.
+    """
+    paths = {}
+    for adapter, mapping in mappings.get('npiv', {}).items():
+        if mapping.get('status', 'LOGGED_IN') != 'LOGGED_IN':
+            continue
+        paths.setdefault(mapping.get('clntid'), dict(clientid=mapping.get('clntid'), adapter=adapter,
+                                                     fc=mapping.get('fc')))
+    return paths
+
+
+def vnic_paths(mappings):
+    """
+    Return the vNIC paths keyed by (client ID, client adapter location code).
+    """
+    paths = {}
+    for adapter, mapping in mappings.get('vnic', {}).items():
+        if 'clntid' not in mapping:
+            continue
+        paths[(mapping['clntid'], mapping.get('clntphysloc'))] = dict(clientid=mapping['clntid'], adapter=adapter,
+                                                                      clntphysloc=mapping.get('clntphysloc'),
+                                                                      backing=mapping.get('backing'))
+    return paths
+
+
+def single_pathed(paths, names):
+    """
+    Hash-join the paths of both VIOS and return the paths found on one side only.
+    """
+    report = []
+    for index in (0, 1):
+        other = paths[1 - index]
+        for key, path in paths[index].items():
+            if key not in other:
+                report.append(dict(path, vios=names[index]))
+    report.sort(key=lambda path: (client_key(path['clientid']), path['vios'], path['adapter']))
+    return dict(single_pathed=report, clients=sorted(set(path['clientid'] for path in report), key=client_key))
+
+
+def vscsi_report(pair, names):
+    """
+    Hash-join the VSCSI paths of both VIOS. The paths of a client partition
+    that has paths of unknown disk identity on the other VIOS cannot be told
+    single-pathed, they are reported as unverifiable with the unknown ones.
+    """
+    sides = [vscsi_paths(side) for side in pair]
+    report = single_pathed([paths for paths, unknown in sides], names)
+    unverifiable = [dict(path, vios=names[index]) for index, (paths, unknown) in enumerate(sides) for path in unknown]
+    unknown_clients = [set(path['clientid'] for path in unknown) for paths, unknown in sides]
+    verified = []
+    for path in report['single_pathed']:
+        if path['clientid'] in unknown_clients[1 - names.index(path['vios'])]:
+            unverifiable.append(path)
+        else:
+            verified.append(path)
+    unverifiable.sort(key=lambda path: (client_key(path['clientid']), path['vios'], path['adapter'], path['vtd']))
+    return dict(single_pathed=verified, clients=sorted(set(path['clientid'] for path in verified), key=client_key),
+                unverifiable=unverifiable,
+                unverifiable_clients=sorted(set(path['clientid'] for path in unverifiable), key=client_key))
+
+
+def vios_redundancy(mappings, other, names=None):
+    """
+    Report the client partitions that only have a path through one VIOS of a pair.
+    """
+    if not isinstance(mappings, dict) or not isinstance(other, dict):
+        raise AnsibleFilterError('vios_redundancy expects the mappings facts of two VIOS')
+    names = list(names or ['vios1', 'vios2'])
+    if len(names) != 2 or names[0] == names[1]:
+        raise AnsibleFilterError('vios_redundancy expects two distinct VIOS names')
+
+    pair = (mappings, other)
+    report = {}
+    report['vscsi'] = vscsi_report(pair, names)
+    report['npiv'] = single_pathed([npiv_paths(side) for side in pair], names)
+    report['vnic'] = single_pathed([vnic_paths(side) for side in pair], names)
+
+    report['net'] = dict(single_pathed=[])
+    if all('net' in side for side in pair):
+        has_sea = [any(mapping.get('sea') and mapping.get('status', 'Available') == 'Available'
+                       for mapping in side['net'].values()) for side in pair]
+        if has_sea[0] != has_sea[1]:
+            report['net']['single_pathed'].append(names[has_sea.index(True)])
+
+    clients = set()
+    for component in ('vscsi', 'npiv', 'vnic'):
+        clients.update(report[component]['clients'])
+    report['single_pathed_clients'] = sorted(clients, key=client_key)
+    return report
+
+
+class FilterModule(object):
+    """
+    VIOS mapping filters.
+    """
+
+    def filters(self):
+        return {
+            'vios_redundancy': vios_redundancy,
+        }
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+Run the VIOS lsmap command and parse its -fmt output into mappings.
+"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import subprocess
+import tempfile
+
+
+delimiter = ','  # Delimiter to use for lsmap -fmt
+max_unparsed_lines = 100  # Lines of lsmap output kept when they are not records
+
+
+def parse_vscsi(fields, records):
+    """
+    Parse a record of lsmap output for VSCSI mappings.
+    """
+    # List of fields returned by lsmap:
+    # svsa:physloc:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
+    svsa = fields[0]
+    mapping = {}
+    mapping['physloc'] = fields[1]
+    # Do the hexadecimal conversion ourselves as not all VIOS levels
+    # support lsmap -dec option.
+    mapping['clientid'] = int(fields[2], 16)
+    mapping['vtds'] = {}
+    for i in range(3, len(fields) - 5, 6):
+        if not fields[i]:
+            break
+        vtd = {}
+        vtd['status'] = fields[i + 1]
+        vtd['lun'] = fields[i + 2]
+        if fields[i + 3]:
+            vtd['backing'] = fields[i + 3]
+        if fields[i + 4]:
+            vtd['bdphysloc'] = fields[i + 4]
+        if fields[i + 5] != 'N/A':
+            vtd['mirrored'] = fields[i + 5] != 'false'
+
+        mapping['vtds'][fields[i]] = vtd
+    records[svsa] = mapping
+
+
+def parse_npiv(fields, records):
+    """
+    Parse a record of lsmap -npiv output.
+    """
+    # List of fields returned by lsmap -npiv:
+    # name:physloc:clntid:clntname:clntos:status:fc:fcphysloc:ports:flags:vfcclient:vfcclientdrc
+    name = fields[0]
+    mapping = {}
+    mapping['physloc'] = fields[1]
+    mapping['clntid'] = int(fields[2])
+    if fields[3]:
+        mapping['clntname'] = fields[3]
+    if fields[4]:
+        mapping['clntos'] = fields[4]
+    mapping['status'] = fields[5]
+    if fields[6]:
+        mapping['fc'] = fields[6]
+    if fields[7]:
+        mapping['fcphysloc'] = fields[7]
+    mapping['ports'] = int(fields[8])
+    mapping['flags'] = int(fields[9], 16)
+    if fields[10]:
+        mapping['vfcclient'] = fields[10]
+    if fields[11]:
+        mapping['vfcclientdrc'] = fields[11]
+
+    records[name] = mapping
+
+
+def parse_net(fields, records):
+    """
+    Parse a record of lsmap -net output.
+    """
+    # List of fields returned by lsmap -net:
+    # svea:physloc:sea:backing:status:bdphysloc
+    svea = fields[0]
+    mapping = {}
+    mapping['physloc'] = fields[1]
+    if fields[2]:
+        mapping['sea'] = fields[2]
+    if fields[3]:
+        mapping['backing'] = fields[3]
+    if fields[4]:
+        mapping['status'] = fields[4]
+    if fields[5]:
+        mapping['bdphysloc'] = fields[5]
+
+    records[svea] = mapping
+
+
+def parse_vnic(fields, records):
+    """
+    Parse a record of lsmap -vnic output.
+    """
+    # List of fields returned by lsmap -vnic:
+    # name:physloc:clntid:clntname:clntos:backing:status:bdphysloc:clntdev:clntphysloc
+    name = fields[0]
+    mapping = {}
+    mapping['physloc'] = fields[1]
+    if fields[2] != 'N/A':
+        mapping['clntid'] = int(fields[2])
+    if fields[3] != 'N/A':
+        mapping['clntname'] = fields[3]
+    if fields[4] != 'N/A':
+        mapping['clntos'] = fields[4]
+    if fields[5] != 'N/A':
+        mapping['backing'] = fields[5]
+    mapping['status'] = fields[6]
+    mapping['bdphysloc'] = fields[7]
+    if fields[8] != 'N/A':
+        mapping['clntdev'] = fields[8]
+    mapping['clntphysloc'] = fields[9]
+
+    records[name] = mapping
+
+
+def parse_ams(fields, records):
+    """
+    Parse a record of lsmap -ams output.
+    """
+    # List of fields returned by lsmap -ams:
+    # paging:streamid:clientid:status:redundancy:backing:poolid:vasi:pager:vbsd
+    paging = fields[0]
+    mapping = {}
+    mapping['streamid'] = fields[1]
+    # Do the hexadecimal conversion ourselves as not all VIOS levels
+    # support lsmap -dec option.
+    mapping['clntid'] = int(fields[2], 16)
+    mapping['status'] = fields[3]
+    mapping['redundancy'] = fields[4] != 'no'
+    mapping['backing'] = fields[5]
+    mapping['poolid'] = fields[6]
+    if fields[7]:
+        mapping['vasi'] = fields[7]
+    if fields[8]:
+        mapping['pager'] = fields[8]
+    if fields[9]:
+        mapping['vbsd'] = fields[9]
+
+    records[paging] = mapping
+
+
+def parse_suspend(fields, records):
+    """
+    Parse a record of lsmap -suspend output.
+    """
+    # List of fields returned by lsmap -suspend:
+    # svsa:state:clientname:streamid:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
+    svsa = fields[0]
+    mapping = {}
+    mapping['state'] = fields[1]
+    if fields[2]:
+        mapping['clientname'] = fields[2]
+    mapping['streamid'] = fields[3]
+    # Do the hexadecimal conversion ourselves as not all VIOS levels
+    # support lsmap -dec option.
+    mapping['clientid'] = int(fields[4], 16)
+    mapping['vtds'] = {}
+    for i in range(5, len(fields) - 5, 6):
+        if not fields[i]:
+            break
+        vtd = {}
+        vtd['status'] = fields[i + 1]
+        vtd['lun'] = fields[i + 2]
+        if fields[i + 3]:
+            vtd['backing'] = fields[i + 3]
+        if fields[i + 4]:
+            vtd['bdphysloc'] = fields[i + 4]
+        if fields[i + 5] != 'N/A':
+            vtd['mirrored'] = fields[i + 5] != 'false'
+
+        mapping['vtds'][fields[i]] = vtd
+    records[svsa] = mapping
+
+
+def parse_cluster(fields, records):
+    """
+    Parse a record of lsmap -clustername output.
+    Records are grouped by physical location code of the server virtual adapter.
+    """
+    # List of fields returned by lsmap -clustername:
+    # physloc:clientid:vtd:lun:backing
+    physloc = fields[0]
+    if physloc not in records:
+        records[physloc] = {}
+        records[physloc]['vtds'] = {}
+        if fields[1] != 'suspended':
+            # Do the hexadecimal conversion ourselves as not all VIOS levels
+            # support lsmap -dec option.
+            records[physloc]['clientid'] = int(fields[1], 16)
+
+    if fields[2]:
+        vtd = fields[2]
+        vtds = records[physloc].setdefault('vtds', {})
+        vtds[vtd] = {}
+        vtds[vtd]['lun'] = fields[3]
+        vtds[vtd]['backing'] = fields[4]
+
+
+def is_lu_backing(backing):
+    """
+    Check if a backing device name is a shared storage pool logical unit,
+    named lu_name.udid with a hexadecimal udid.
+    """
+    name, sep, udid = backing.rpartition('.')
+    return bool(name and udid) and all(char in '0123456789abcdefABCDEF' for char in udid)
+
+
+def split_record(line, min_fields):
+    """
+    Split a line of lsmap -fmt output into its stripped fields.
+    Return None if the line has fewer than min_fields fields.
+    """
+    fields = line.split(delimiter)
+    if len(fields) < min_fields:
+        return None
+    return [field.strip() for field in fields]
+
+
+def parse_output(stdout, parse_record, min_fields):
+    """
+    Parse the whole output of an lsmap command, lines that are not records
+    are skipped.
+    Return a dict of records.
+    """
+    records = {}
+    for line in stdout.splitlines():
+        fields = split_record(line, min_fields)
+        if fields is None:
+            continue
+        try:
+            parse_record(fields, records)
+        except (ValueError, IndexError):
+            continue
+    return records
+
+
+def stream_command(module, cmd, consume):
+    """
+    Run a command with the environment of module.run_command and pass each
+    line of its standard output to consume as the command produces it.
+    Output is decoded as run_command does, bytes that are not valid UTF-8
+    are kept as surrogates.
+    Return a tuple (rc, stderr), rc is 127 if the command cannot be run.
+    """
+    env = os.environ.copy()
+    env.update(module.run_command_environ_update or {})
+    with tempfile.TemporaryFile() as errfile:
+        try:
+            proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=errfile, env=env, close_fds=True)
+        except OSError as err:
+            return 127, str(err)
+        try:
+            for line in proc.stdout:
+                consume(line.decode('utf-8', errors='surrogateescape'))
+        finally:
+            proc.stdout.close()
+            ret = proc.wait()
+        errfile.seek(0)
+        stderr = errfile.read().decode('utf-8', errors='surrogateescape')
+    return ret, stderr
+
+
+def stream_lsmap(module, cmd, parse_line):
+    """
+    Run an lsmap command and pass each line of its output to parse_line as
+    the command produces it, so that the whole output is never held in memory.
+    parse_line returns whether the line was a record, the first
+    max_unparsed_lines lines that are not are kept to report a failure.
+    Return a tuple (rc, stdout, stderr), stdout has the unparsed lines.
+    """
+    unparsed = []
+
+    def consume(line):
+        if not parse_line(line) and len(unparsed) < max_unparsed_lines:
+            unparsed.append(line)
+
+    ret, stderr = stream_command(module, cmd, consume)
+    return ret, ''.join(unparsed), stderr
+
+
+def command_failed(module, results, cmd, ret, stdout, stderr):
+    """
+    Fail the module with results and the output of a command.
+    """
+    results['cmd'] = ' '.join(cmd)
+    results['msg'] = f'{cmd[1] if os.path.basename(cmd[0]) == "ioscli" else cmd[0]} failed rc={ret}'
+    results['stdout'] = stdout
+    results['stderr'] = stderr
+    module.fail_json(**results)
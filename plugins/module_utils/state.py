@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+"""
+State files kept on the managed host between runs of a module.
+"""
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+import os
+import stat
+import tempfile
+
+
+# Default directory of the state files, created readable by its owner only
+state_dir = '/var/adm/ansible'
+
+
+class UntrustedStateError(Exception):
+    """
+    A state file exists but could have been written by another user.
+    """
+
+
+def read_state(path):
+    """
+    Return the content of a state file as bytes, or None if it does not exist.
+    Symbolic links are not followed. Raise UntrustedStateError if the file is
+    not a regular file owned by the current user or is writable by others.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+    except OSError:
+        return None
+    with os.fdopen(fd, 'rb') as state_file:
+        info = os.fstat(state_file.fileno())
+        if not stat.S_ISREG(info.st_mode) or info.st_uid != os.geteuid() \
+                or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+            raise UntrustedStateError(f'{path} is not a regular file owned by the user or is writable by others')
+        return state_file.read()
+
+
+def write_state(path, data):
+    """
+    Atomically replace a state file with data, readable by the current user only.
+    The data is written to a new file created by mkstemp in the same directory
+    and renamed, so an existing file or symbolic link is never opened for
+    writing. The directory is created if needed. Raise OSError on failure.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'wb') as state_file:
+            state_file.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def remove_state(path):
+    """
+    Remove a state file if it exists.
+    """
+    try:
+        os.remove(path)
+    except OSError:
+        pass
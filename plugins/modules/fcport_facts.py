@@ -0,0 +1,337 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+author:
+- AIX Development Team (@pbfinley1911)
+module: fcport_facts
+short_description: Returns the load of the physical fibre channel ports as facts
+description:
+- Samples the fcstat counters of every available physical fibre channel port twice, all the
+  ports concurrently, and computes their throughput, request and error rates over the interval.
+- The rates are aggregated with the NPIV mappings into a per-port load, with the number of
+  virtual fibre channel server adapters and client partitions of each port.
+version_added: '2.9'
+requirements:
+- VIOS >= 2.2.5.0
+- Python >= 2.7
+options:
+  interval:
+    description:
+    - Specifies the time in seconds between the two samples.
+    type: int
+    default: 5
+  ports:
+    description:
+    - Specifies the physical fibre channel ports to sample.
+    - If not set, all the available C(fcs) adapters are sampled.
+    type: list
+    elements: str
+  mappings:
+    description:
+    - Specifies the I(mappings) facts returned by M(ibm.power_vios.mapping_facts), in the
+      C(nested) format, to aggregate the port load with.
+    - If not set, the C(npiv) mappings are retrieved with lsmap.
+    type: dict
+notes:
+- The throughput and frame rates include the traffic of the NPIV client partitions. The
+  request rate only counts the I/O initiated by the VIOS itself, fcstat does not see the
+  requests of the NPIV clients.
+'''
+
+EXAMPLES = r'''
+- name: Sample the load of the physical fibre channel ports over 10 seconds
+  fcport_facts:
+    interval: 10
+- name: Print the ports by decreasing throughput
+  debug:
+    msg: "{{ ansible_facts.fcports | dict2items | sort(attribute='value.mbps', reverse=true)
+             | map(attribute='key') | list }}"
+'''
+
+RETURN = r'''
+ansible_facts:
+  description:
+  - Facts to add to ansible_facts about the physical fibre channel ports.
+  returned: always
+  type: complex
+  contains:
+    fcports:
+      description:
+      - Maps physical fibre channel port name to its load over the interval.
+      - I(mbps), I(tx_mbps) and I(rx_mbps) are the total, transmitted and received
+        megabytes per second, I(frames_per_sec) the transmitted and received frames
+        per second and I(iops) the requests of the VIOS per second.
+      - I(errors) has the error counters since the last reset of the port and
+        I(new_errors) their increase over the interval.
+      - I(vfchosts) and I(clients) are the number of virtual fibre channel server adapters
+        mapped to the port and of distinct client partitions, I(adapters) their names.
+        C(vfchost) adapters without a client partition are not counted in I(clients).
+      returned: always
+      type: dict
+      sample:
+        "fcports": {
+            "fcs0": {
+                "wwpn": "0x10000090FA1B2C3D",
+                "speed": "8 GBIT",
+                "interval": 5.01,
+                "mbps": 212.4,
+                "tx_mbps": 80.1,
+                "rx_mbps": 132.3,
+                "frames_per_sec": 104523.0,
+                "iops": 12.4,
+                "vfchosts": 2,
+                "clients": 2,
+                "adapters": ["vfchost18", "vfchost19"],
+                "errors": {
+                    "error_frames": 0,
+                    "dumped_frames": 0,
+                    "link_failure": 1,
+                    "loss_of_sync": 3,
+                    "loss_of_signal": 0,
+                    "invalid_tx_word": 12,
+                    "invalid_crc": 0,
+                    "no_dma_resource": 0,
+                    "no_adapter_elements": 0,
+                    "no_command_resource": 0
+                },
+                "new_errors": {
+                    "error_frames": 0,
+                    "dumped_frames": 0,
+                    "link_failure": 0,
+                    "loss_of_sync": 0,
+                    "loss_of_signal": 0,
+                    "invalid_tx_word": 0,
+                    "invalid_crc": 0,
+                    "no_dma_resource": 0,
+                    "no_adapter_elements": 0,
+                    "no_command_resource": 0
+                }
+            }
+        }
+cmd:
+  description: The last command.
+  returned: If the command was run.
+  type: str
+msg:
+  description: The execution message.
+  returned: always
+  type: str
+stdout:
+  description: The standard output of the failed command.
+  returned: If the command failed.
+  type: str
+stderr:
+  description: The standard error of the failed command.
+  returned: If the command failed.
+  type: str
+'''
+
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import delimiter, parse_npiv, parse_output, command_failed
+
+
+ioscli_cmd = '/usr/ios/cli/ioscli'
+lsdev_cmd = '/usr/sbin/lsdev'
+fcstat_cmd = '/usr/bin/fcstat'
+# fcstat error counters
+error_counters = {
+    'Error Frames': 'error_frames',
+    'Dumped Frames': 'dumped_frames',
+    'Link Failure Count': 'link_failure',
+    'Loss of Sync Count': 'loss_of_sync',
+    'Loss of Signal': 'loss_of_signal',
+    'Invalid Tx Word Count': 'invalid_tx_word',
+    'Invalid CRC Count': 'invalid_crc',
+    'No DMA Resource Count': 'no_dma_resource',
+    'No Adapter Elements Count': 'no_adapter_elements',
+    'No Command Resource Count': 'no_command_resource',
+}
+results = dict(
+    changed=False,
+    cmd='',
+    msg='',
+    stdout='',
+    stderr='',
+)
+
+
+def list_ports(module):
+    """
+    Return the names of the available physical fibre channel ports.
+    """
+    cmd = [lsdev_cmd, '-C', '-c', 'adapter', '-S', 'a', '-F', 'name']
+    ret, stdout, stderr = module.run_command(cmd)
+    if ret != 0:
+        command_failed(module, results, cmd, ret, stdout, stderr)
+    return [line.strip() for line in stdout.splitlines() if line.strip().startswith('fcs')]
+
+
+def npiv_mappings(module):
+    """
+    Return the NPIV mappings.
+    """
+    cmd = [ioscli_cmd, 'lsmap', '-npiv', '-all', '-fmt', delimiter]
+    ret, stdout, stderr = module.run_command(cmd)
+    if ret != 0:
+        if ret in (10, 63):
+            return {}  # E_NODEVPHYSLOC or E_NOTSVFCA_S
+        command_failed(module, results, cmd, ret, stdout, stderr)
+    return parse_output(stdout, parse_npiv, 12)
+
+
+def run_fcstat(module, port):
+    """
+    Run fcstat on a port.
+    Return a tuple (time, rc, stdout, stderr), time is when the command completed.
+    """
+    ret, stdout, stderr = module.run_command([fcstat_cmd, port])
+    return time.time(), ret, stdout, stderr
+
+
+def parse_fcstat(stdout):
+    """
+    Parse the fcstat output of a port into a dict of counters.
+    The error counters reported in both the IP over FC and the FC SCSI
+    sections are added up, requests are only counted in the FC SCSI one.
+    """
+    counters = dict(errors={})
+    section = ''
+    for line in stdout.splitlines():
+        name, sep, value = line.partition(':')
+        if not sep:
+            if line.strip():
+                section = line.strip()
+            continue
+        name = name.strip()
+        values = value.split()
+        if name == 'World Wide Port Name':
+            counters['wwpn'] = value.strip()
+        elif name == 'Port Speed (running)':
+            counters['speed'] = value.strip()
+        elif name in ('Frames', 'Words') and len(values) >= 2:
+            # Transmit and receive statistics
+            counters[name.lower()] = (int(values[0]), int(values[1]))
+        elif name in ('Input Requests', 'Output Requests', 'Control Requests') and values:
+            if section.startswith('FC SCSI'):
+                counters['requests'] = counters.get('requests', 0) + int(values[0])
+        elif name in error_counters and values:
+            errors = counters['errors']
+            errors[error_counters[name]] = errors.get(error_counters[name], 0) + int(values[0])
+    return counters
+
+
+def sample_ports(module, ports):
+    """
+    Run fcstat on all the ports concurrently.
+    Return a dict of port name to (time, counters).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(len(ports), 16))) as executor:
+        futures = dict((port, executor.submit(run_fcstat, module, port)) for port in ports)
+        outputs = dict((port, future.result()) for port, future in futures.items())
+
+    samples = {}
+    for port, (timestamp, ret, stdout, stderr) in outputs.items():
+        if ret != 0:
+            command_failed(module, results, [fcstat_cmd, port], ret, stdout, stderr)
+        try:
+            samples[port] = (timestamp, parse_fcstat(stdout))
+        except ValueError:
+            results['msg'] = f'Cannot parse fcstat output of {port}'
+            results['stdout'] = stdout
+            module.fail_json(**results)
+    return samples
+
+
+def port_load(first, second):
+    """
+    Compute the rates of a port between two samples.
+    """
+    (start, before), (end, after) = first, second
+    elapsed = max(end - start, 0.001)
+    load = dict(interval=round(elapsed, 2))
+    for key in ('wwpn', 'speed'):
+        if key in after:
+            load[key] = after[key]
+
+    # fcstat counts 4-byte words
+    words = [(after['words'][i] - before['words'][i]) * 4.0 / elapsed / 1024 ** 2
+             if 'words' in before and 'words' in after else 0.0 for i in (0, 1)]
+    load['tx_mbps'] = round(words[0], 2)
+    load['rx_mbps'] = round(words[1], 2)
+    load['mbps'] = round(words[0] + words[1], 2)
+    if 'frames' in before and 'frames' in after:
+        frames = sum(after['frames']) - sum(before['frames'])
+        load['frames_per_sec'] = round(frames / elapsed, 1)
+    else:
+        load['frames_per_sec'] = 0.0
+    load['iops'] = round((after.get('requests', 0) - before.get('requests', 0)) / elapsed, 1)
+    load['errors'] = after['errors']
+    load['new_errors'] = dict((name, value - before['errors'].get(name, value))
+                              for name, value in after['errors'].items())
+    return load
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            interval=dict(type='int', default=5),
+            ports=dict(type='list', elements='str'),
+            mappings=dict(type='dict'),
+        ),
+        supports_check_mode=True
+    )
+
+    if module.params['interval'] < 1:
+        results['msg'] = 'interval must be at least 1 second'
+        module.fail_json(**results)
+
+    ports = module.params['ports'] or list_ports(module)
+    if module.params['mappings'] is not None:
+        npiv = module.params['mappings'].get('npiv', {})
+    else:
+        npiv = npiv_mappings(module)
+
+    first = sample_ports(module, ports)
+    time.sleep(module.params['interval'])
+    second = sample_ports(module, ports)
+
+    fcports = {}
+    for port in ports:
+        fcports[port] = port_load(first[port], second[port])
+        fcports[port].update(vfchosts=0, clients=0, adapters=[])
+    clients = dict((port, set()) for port in ports)
+    for adapter, mapping in sorted(npiv.items()):
+        port = mapping.get('fc')
+        if port not in fcports:
+            continue
+        fcports[port]['vfchosts'] += 1
+        fcports[port]['adapters'].append(adapter)
+        # A vfchost not assigned to a client partition has a clntid of 0
+        if mapping.get('clntid'):
+            clients[port].add(mapping['clntid'])
+    for port in ports:
+        fcports[port]['clients'] = len(clients[port])
+
+    results['ansible_facts'] = dict(fcports=fcports)
+    results['msg'] = f'{len(ports)} ports sampled over {module.params["interval"]} seconds'
+    module.exit_json(**results)
+
+
+if __name__ == '__main__':
+    main()
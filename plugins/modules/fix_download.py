@@ -49,11 +49,36 @@ options:
     - Specifies if the directory should be emptied or not.
     type: bool
     default: 'False'
+  file_types:
+    description:
+    - Specifies the types of files of the fix to download. All the files are downloaded if not set.
+    - C(installp) the installp images (bff).
+    - C(deployment_descriptor) the DeploymentDescriptor metadata file.
+    - C(package_descriptor) the PackageDescriptor metadata file.
+    - C(cksum) the cksum verifier image.
+    - The space required in I(directory) is computed on the selected files only.
+    - Only used when I(action=download).
+    type: list
+    elements: str
+    choices: [ installp, deployment_descriptor, package_descriptor, cksum ]
+  exclude_file_types:
+    description:
+    - Specifies the types of files of the fix not to download.
+    - Takes the same values as I(file_types) and is applied after it.
+    - Only used when I(action=download).
+    type: list
+    elements: str
+    choices: [ installp, deployment_descriptor, package_descriptor, cksum ]
 notes:
     - An empty directory is required for downloading the fixes. If directory is not clean, provide consent by using
     - I(clean_directory) as True. This module will clean the directory otherwise will fail with the message
     - "Non empty directory has been provided. Either provide an empty directory or set clean_directory to True."
     - Downloading ISO images are not supported through EFD portal, user needs to manually download from ESS.
+    - The identifier of a pending EFD transaction is saved in C(/var/adm/ansible/fix_download_pending.json) until the response is confirmed,
+      or discarded if the response is an error.
+      The file is readable by root only and is ignored if it is not owned by root or is writable by others.
+      If a previous run timed out or was interrupted, a new run with the same I(action) and I(fix_id) resumes polling that
+      transaction instead of queuing a new request. Pending transactions older than 24 hours are discarded.
 '''
 
 EXAMPLES = r'''
@@ -68,6 +93,15 @@ EXAMPLES = r'''
       action: "download"
       fix_id: "{{ name_fs }}"
       directory: "{{ dir }}"
+
+  - name: Download only the descriptors of a fix for an inventory check
+    fix_download:
+      action: "download"
+      fix_id: "{{ name_fs }}"
+      directory: "{{ dir }}"
+      file_types:
+        - deployment_descriptor
+        - package_descriptor
 '''
 
 RETURN = r'''
@@ -177,12 +211,14 @@ updates:
 '''
 
 import json
+import os
 import time
 import datetime
 import urllib.request
 
 from builtins import round
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.state import state_dir, read_state, write_state, remove_state, UntrustedStateError
 
 event_id = ""
 size_of_file = 0
@@ -192,6 +228,8 @@ confirmresopnse_event_id = ""
 asset = ""
 sr_no = ""
 payload = {}
+pending_file = os.path.join(state_dir, "fix_download_pending.json")
+pending_max_age_ms = 24 * 60 * 60 * 1000
 results = dict(
     changed=False,
     cmd='',
@@ -540,6 +578,26 @@ def check_response(stdout):
         return 0
 
 
+def check_for_server_error(stdout):
+    '''
+    Utility function to check if EFD answered a poll of the transaction with an error.
+
+    arguments:
+        stdout (str) : Contains standard output of the curl command
+
+    returns:
+        True : If the response carries a return code other than 200 (OK)
+        False : In all the other cases
+    '''
+
+    res = json.loads(stdout)
+
+    try:
+        return res["transaction"]["rc"] != 200
+    except (KeyError, TypeError):
+        return 0
+
+
 def check_for_authentication(module, stdout):
     '''
     Utility function to check if there was any authentication related faliure.
@@ -633,13 +691,111 @@ def remove_json_file(module):
     results['msg'] += " The payload file was deleted."
 
 
-def wait_for_response(module):
+def pending_key(module):
+    '''
+    Utility function to build the inputs that identify an EFD transaction.
+
+    arguments:
+        module (dict) : The Ansible module.
+
+    returns:
+        key (dict) : Request inputs that must match for a pending transaction to be resumed.
+    '''
+
+    return {
+        "action": module.params['action'],
+        "fix_id": module.params['fix_id'],
+        "oslevel": oslevel,
+        "asset": asset,
+        "asset_id": asset_id,
+        "serial_number": sr_no,
+    }
+
+
+def load_pending_transaction(module):
+    '''
+    Utility function to look for a pending EFD transaction queued by a previous run with the same inputs.
+
+    arguments:
+        module (dict) : The Ansible module.
+
+    returns:
+        True : If a pending transaction was found, softwareupdate_event_id is set to it.
+        False : If there is no transaction to resume.
+    '''
+
+    global softwareupdate_event_id
+
+    try:
+        content = read_state(pending_file)
+        if content is None:
+            return 0
+        pending = json.loads(content.decode("utf-8"))
+    except UntrustedStateError as err:
+        module.warn("Ignoring the pending EFD transaction: " + str(err))
+        return 0
+    except (IOError, OSError, ValueError):
+        return 0
+    if not isinstance(pending, dict):
+        return 0
+
+    if pending.get("key") != pending_key(module):
+        return 0
+
+    age = round(time.time() * 1000) - pending.get("event_time_ms", 0)
+    if age > pending_max_age_ms or not pending.get("softwareupdate_event_id"):
+        return 0
+
+    softwareupdate_event_id = pending["softwareupdate_event_id"]
+    return 1
+
+
+def save_pending_transaction(module):
+    '''
+    Utility function to persist the identifier of the EFD transaction that was just queued,
+    so that a later run can resume polling it.
+
+    arguments:
+        module (dict) : The Ansible module.
+
+    returns:
+        Nothing
+    '''
+
+    pending = {
+        "key": pending_key(module),
+        "softwareupdate_event_id": softwareupdate_event_id,
+        "event_time_ms": event_time_ms,
+    }
+
+    try:
+        write_state(pending_file, json.dumps(pending, indent=4).encode("utf-8"))
+    except (IOError, OSError) as err:
+        module.warn("Could not save the pending EFD transaction to " + pending_file + ": " + str(err))
+
+
+def clear_pending_transaction(module):
+    '''
+    Utility function to forget the pending EFD transaction once its response has been confirmed
+    or cannot be used.
+
+    arguments:
+        module (dict) : The Ansible module.
+
+    returns:
+        Nothing
+    '''
+
+    remove_state(pending_file)
+
+
+def wait_for_response(module, resumed=False):
     '''
     Utility function to keep sending the request until the required response is received.
 
     arguments:
         module (dict) : The Ansible module.
-        cmd (str) : CURL command to send the payload.
+        resumed (bool) : True if polling a transaction queued by a previous run, the first poll is then sent right away.
 
     returns:
         Nothing
@@ -648,9 +804,10 @@ def wait_for_response(module):
     counter = 0
 
     while counter <= 11:
-        time.sleep(10)
+        if counter or not resumed:
+            time.sleep(10)
         rc, stdout, stderr = module.run_command(curl_cmd)
-        if check_for_updates(stdout):
+        if check_for_updates(stdout) or check_for_server_error(stdout):
             break
         counter += 1
 
@@ -659,21 +816,78 @@ def wait_for_response(module):
     results['stderr'] = stderr
     results['stdout'] = stdout
 
+    if check_for_server_error(stdout):
+        # The transaction cannot be resumed, the next run queues a new one.
+        clear_pending_transaction(module)
+        results['msg'] = "The EFD portal returned an error for transaction " + softwareupdate_event_id + "."
+        module.fail_json(**results)
     if counter > 11 and not check_for_updates(stdout):
         results['msg'] = "Could not find any fixes for the machine. Request timed out."
+        if resumed:
+            # Give up on a transaction that already timed out twice, the next run queues a new one.
+            clear_pending_transaction(module)
+        else:
+            results['msg'] += " Transaction " + softwareupdate_event_id + " will be resumed on the next run."
         module.fail_json(**results)
     else:
         if not check_for_authentication(module, stdout):
+            # The response is final, resuming the transaction would fail the same way.
+            clear_pending_transaction(module)
             module.fail_json(**results)
         results['msg'] = "Response received."
 
 
-def get_URL(module):
+def get_file_type(file_info):
+    '''
+    Utility function to classify a file of a fix returned by EFD.
+
+    arguments:
+        file_info (dict) - Entry of the "files" list of a fix.
+
+    returns:
+        file_type (str) - One of installp, deployment_descriptor, package_descriptor or cksum.
+    '''
+
+    descriptor = file_info.get("descriptor", "")
+
+    if descriptor == "metadata/deployment-descriptor.fix":
+        return "deployment_descriptor"
+    if descriptor == "metadata/package-descriptor.fix":
+        return "package_descriptor"
+    if "cksum" in file_info.get("description", "") or file_info.get("url", "").endswith("/ck_sum.bff"):
+        return "cksum"
+    return "installp"
+
+
+def is_file_selected(module, file_info):
+    '''
+    Utility function to check if a file of a fix matches the file_types and exclude_file_types filters.
+
+    arguments:
+        module (dict) - The Ansible module
+        file_info (dict) - Entry of the "files" list of a fix.
+
+    returns:
+        True - If the file needs to be downloaded.
+        False - If the file is filtered out.
+    '''
+
+    file_type = get_file_type(file_info)
+
+    if module.params['file_types'] and file_type not in module.params['file_types']:
+        return 0
+    if module.params['exclude_file_types'] and file_type in module.params['exclude_file_types']:
+        return 0
+    return 1
+
+
+def get_URL(module, resumed=False):
     '''
     Function to retreive the URL from the JSON response
 
     arguments:
         module (dict) - The Ansible module
+        resumed (bool) - True if the transaction was queued by a previous run.
 
     returns:
         URL (str) - URL from where the fix can be downloaded.
@@ -684,7 +898,7 @@ def get_URL(module):
 
     generate_payload(module, "download")
 
-    wait_for_response(module)
+    wait_for_response(module, resumed)
 
     res = json.loads(results['stdout'])
 
@@ -694,16 +908,25 @@ def get_URL(module):
 
     URL = []
 
+    found = 0
+
     for fix_group in fields:
         for keys in fix_group["files"]:
+            found = 1
+            if not is_file_selected(module, keys):
+                continue
             URL.append(keys["url"])
             size_of_file += keys['size']
 
     if URL:
         return URL
+    # The response is final, the next run queues a new transaction.
+    clear_pending_transaction(module)
+    if found:
+        results['msg'] = "None of the files of the fix match the requested file types."
     else:
         results['msg'] = "Could not retrieve the URLs."
-        module.fail_json(**results)
+    module.fail_json(**results)
 
 
 def generate_event_details():
@@ -1162,6 +1385,7 @@ def send_post(module):
     if not check_response(stdout):
         results['msg'] = "POST request unsuccessful."
         module.fail_json(**results)
+    save_pending_transaction(module)
     results['msg'] = "POST request successful."
 
 
@@ -1188,15 +1412,17 @@ def send_downloadpost(module):
     if not check_response(stdout):
         results['msg'] = "POST request unsuccessful."
         module.fail_json(**results)
+    save_pending_transaction(module)
     results['msg'] = "POST request successful."
 
 
-def get_fixes(module):
+def get_fixes(module, resumed=False):
     '''
     To send the POST request to EFD portal including all the necessary information.
 
     arguments:
         module (dict): The Ansible module.
+        resumed (bool): True if the transaction was queued by a previous run.
 
     returns:
         Nothing
@@ -1204,7 +1430,7 @@ def get_fixes(module):
 
     generate_payload(module, "geturl")
 
-    wait_for_response(module)
+    wait_for_response(module, resumed)
 
     res = json.loads(results['stdout'])
 
@@ -1236,6 +1462,7 @@ def confirm_json(module):
         results['msg'] = "Could not send confirm request."
         module.fail_json(**results)
 
+    clear_pending_transaction(module)
     results['msg'] += " Response confirmed."
 
 
@@ -1250,7 +1477,11 @@ def main():
             directory=dict(type='str',
                            default='/'),
             clean_directory=dict(type='bool',
-                                 default=False)
+                                 default=False),
+            file_types=dict(type='list', elements='str',
+                            choices=['installp', 'deployment_descriptor', 'package_descriptor', 'cksum']),
+            exclude_file_types=dict(type='list', elements='str',
+                                    choices=['installp', 'deployment_descriptor', 'package_descriptor', 'cksum'])
         ),
     )
 
@@ -1272,16 +1503,20 @@ def main():
     action = module.params['action']
 
     if action == "list":
-        send_post(module)
-        get_fixes(module)
+        resumed = load_pending_transaction(module)
+        if not resumed:
+            send_post(module)
+        get_fixes(module, resumed)
         confirm_json(module)
     else:
         if not module.params['fix_id']:
             results['msg'] = "Fix id was not provided."
             module.fail_json(**results)
         check_empty_directory(module)
-        send_downloadpost(module)
-        URL = get_URL(module)
+        resumed = load_pending_transaction(module)
+        if not resumed:
+            send_downloadpost(module)
+        URL = get_URL(module, resumed)
         download_fix(module, URL)
         confirm_json(module)
 
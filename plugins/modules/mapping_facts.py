@@ -39,16 +39,43 @@ options:
     type: str
     choices: [vscsi, net, npiv, vnic, ams, suspend, cluster, all]
     default: all
+  gather_subset:
+    description:
+    - Specifies the list of types of devices to retrieve information for, takes
+      the same values as I(component).
+    - A value prefixed with C(!) excludes that type, for instance C(!cluster).
+      If only exclusions are given, all the other types are retrieved.
+    - Overrides I(component) when set.
+    - As with I(component), the module fails if a single type is requested and
+      the VIOS has no adapter of that type.
+    type: list
+    elements: str
+  fields:
+    description:
+    - Specifies, for each type of devices, the attributes to return.
+    - Keys are types of devices as in I(component), values are lists of attribute
+      names of the server adapter or of its virtual target devices, as documented
+      in the I(mappings) facts.
+    - The virtual target devices are only returned if at least one of their
+      attributes is requested.
+    - Types of devices not listed return all their attributes.
+    type: dict
   vadapter:
     description:
-    - Specifies the device name of a server virtual adapter.
+    - Specifies the device names of server virtual adapters.
+    - When several adapters are given, lsmap is run once per type of devices for all
+      the adapters and the output is filtered.
     - Mutually exclusive with I(physloc).
-    type: str
+    type: list
+    elements: str
   physloc:
     description:
-    - Specifies the device physical location code of a server virtual adapter.
+    - Specifies the device physical location codes of server virtual adapters.
+    - When several location codes are given, lsmap is run once per type of devices
+      for all the adapters and the output is filtered.
     - Mutually exclusive with I(vadapter).
-    type: str
+    type: list
+    elements: str
   vtd:
     description:
     - Specifies the active memory sharing (AMS) paging device to be displayed.
@@ -57,12 +84,25 @@ options:
     description:
     - Specifies the host name or IP address of the VIOS partition.
     type: str
+  cluster_nodes:
+    description:
+    - Specifies whether to retrieve the shared storage pool mappings of each node of the
+      cluster separately, in the I(cluster_nodes) mappings instead of the I(cluster) mappings.
+    - The nodes are listed with C(cluster -status) and their mappings are retrieved
+      concurrently, up to I(workers) at a time. A node whose mappings cannot be retrieved
+      is reported with an C(errmsg) instead of failing the module.
+    - If I(hostname) is set, only that node is queried.
+    type: bool
+    default: false
   cpid:
     description:
-    - Specifies the client partition ID, in decimal, for which to return device
+    - Specifies the client partition IDs, in decimal, for which to return device
       mapping information.
-    - This option is only supported on certain VIOS levels.
-    type: str
+    - A single client partition ID is only supported on certain VIOS levels.
+      When several IDs are given, lsmap is run once per type of devices for all
+      the client partitions and the output is filtered.
+    type: list
+    elements: str
   types:
     description:
     - "Specifies the type of devices to display.
@@ -78,6 +118,187 @@ options:
     - C(usb_disk) to list USB disks.
     type: list
     elements: str
+  workers:
+    description:
+    - Maximum number of lsmap commands to run concurrently when several
+      components are retrieved, for instance with I(component=all).
+    - C(1) runs the commands one after the other.
+    type: int
+    default: 4
+  cache:
+    description:
+    - Specifies whether to cache the mappings on the VIOS.
+    - The cached mappings are returned as long as the device configuration
+      fingerprint (modification time of the ODM customized device classes and
+      the list of devices with their status) is unchanged and the cached
+      mappings are not older than I(max_age).
+    - Mappings are cached per combination of the other options.
+    type: bool
+    default: false
+  cache_file:
+    description:
+    - Specifies the file used to store the cached mappings.
+    - Only used if I(cache=true).
+    type: path
+    default: /var/adm/ansible/mapping_facts_cache.json
+  max_age:
+    description:
+    - Specifies the maximum age, in seconds, of cached mappings.
+    - Shared storage pool mappings of other cluster nodes and the client partition
+      information of the mappings do not change the local device configuration,
+      use a smaller value to bound their staleness.
+    - Only used if I(cache=true).
+    type: int
+    default: 300
+  delta:
+    description:
+    - Specifies whether to return only the changes since the snapshot given by I(since).
+    - The last gathered mappings are kept on the VIOS as a snapshot, identified by
+      the returned I(snapshot_id).
+    - If I(since) matches the kept snapshot, the changes are returned in I(delta) and
+      the mappings are not added to the facts. Otherwise the full mappings are returned.
+    type: bool
+    default: false
+  since:
+    description:
+    - Specifies the snapshot identifier, returned by a previous run, to compute the changes from.
+    - Only used if I(delta=true).
+    type: str
+  snapshot_file:
+    description:
+    - Specifies the file used to keep the last snapshot of the mappings.
+    - Only used if I(delta=true).
+    type: path
+    default: /var/adm/ansible/mapping_facts_snapshot.json
+  indexes:
+    description:
+    - Specifies the reverse lookup tables to build in the I(mapping_indexes) facts.
+    - C(backing) to index by backing device (hdisk, logical volume, logical unit, file, ...).
+    - C(client) to index by client partition ID, adapters without client partition (ID 0) are not indexed.
+    - C(physloc) to index by physical location code of the server adapter, the backing
+      device or the physical fibre channel adapter.
+    - C(fc) to index by physical fibre channel adapter name.
+    type: list
+    elements: str
+    choices: [backing, client, physloc, fc]
+  graph:
+    description:
+    - Specifies whether to return the virtualization topology as a graph in the
+      I(mapping_graph) facts.
+    - Nodes are typed and have stable identifiers of the form C(type:name), edges go
+      from the client partition to the server adapter, the virtual target device,
+      the backing device and the physical location of the fibre channel port.
+    type: bool
+    default: false
+  graph_file:
+    description:
+    - Specifies a file on the VIOS to write the topology graph to.
+    type: path
+  graph_format:
+    description:
+    - Specifies the format of I(graph_file).
+    - C(json) for the same layout as the I(mapping_graph) facts.
+    - C(graphml) for GraphML, readable by most graph tools.
+    type: str
+    choices: [json, graphml]
+    default: json
+  enrich:
+    description:
+    - Specifies the additional information to attach to the mappings.
+    - C(backing) to attach the I(attributes) of the backing device to each virtual target
+      device of the C(vscsi) and C(suspend) mappings. The attributes of all the backing
+      devices are read with a fixed number of bulk queries, whatever the number of devices.
+    - C(npiv) to attach the WWPN, fabric state and NPIV capacity of the physical port to
+      each C(npiv) mapping as I(fcport). Each physical port is queried once, concurrently,
+      whatever the number of adapters mapped to it.
+    type: list
+    elements: str
+    choices: [backing, npiv]
+  format:
+    description:
+    - Specifies the layout of the I(mappings) facts.
+    - C(nested) for dicts of adapters and virtual target devices, as documented below.
+    - C(columnar) for one table per component, as parallel column arrays with one row
+      per virtual target device, or per adapter for the components without virtual
+      target devices. Adapter attributes are repeated on the rows of their virtual target
+      devices and nested attributes are flattened into dotted column names, such as
+      C(attributes.size). The key columns are C(adapter), or C(cluster), C(node) and C(physloc)
+      for the cluster components, and C(vtd). The columns with few distinct values, such as
+      C(adapter), C(physloc), C(status) or C(clntos), are interned, their values are indexes
+      into the I(strings) list of the table and their names are listed in I(interned).
+    - Much more compact than C(nested) on VIOS with many mappings. I(mapping_indexes),
+      I(mapping_graph), I(delta) and I(anomalies) still refer to the C(nested) layout.
+    type: str
+    choices: [nested, columnar]
+    default: nested
+  consistency:
+    description:
+    - Specifies whether to check the mappings against the devices of the VIOS and
+      report the stale configuration in I(anomalies).
+    - The check uses all the C(vscsi) and C(npiv) mappings of the VIOS. They are
+      retrieved again, without projection, if I(fields), I(gather_subset), I(component),
+      I(vadapter), I(physloc), I(cpid) or I(types) restrict the gathered mappings.
+    - Shared storage pool logical unit backings are not in the device list of the VIOS,
+      they are checked against the C(cluster) mappings when these are gathered and
+      skipped otherwise, or if lsmap failed for the cluster or one of its nodes.
+    type: bool
+    default: false
+  stats:
+    description:
+    - Specifies whether to return in I(stats) the commands run for each component, with
+      their wall time, parse time and record counts.
+    - Statistics are only available when the mappings are gathered, not on a cache hit.
+    type: bool
+    default: false
+  history:
+    description:
+    - Specifies whether to append the mappings to the history store I(history_file).
+    - The first snapshot is stored in full, the following ones as the changes from their
+      predecessor. A snapshot identical to the last one is not stored again.
+    type: bool
+    default: false
+  history_file:
+    description:
+    - Specifies the gzip-compressed file of the history store.
+    - Each combination of the options that select mappings has its own history.
+    type: path
+    default: /var/adm/ansible/mapping_facts_history.json.gz
+  history_retention:
+    description:
+    - Specifies the number of days of history to keep.
+    - Only used if I(history=true).
+    type: int
+    default: 30
+  history_at:
+    description:
+    - Specifies a time to return the mappings at, from the history store.
+    - The time is given in seconds since the Epoch or as a local date and time
+      C(YYYY-MM-DD[THH:MM[:SS]]).
+    - lsmap is not run, only I(history) is returned.
+    - Mutually exclusive with I(history_from).
+    type: str
+  history_from:
+    description:
+    - Specifies a time to return the changes of the mappings from, up to I(history_to),
+      from the history store.
+    - Same format as I(history_at).
+    - lsmap is not run, only I(history) is returned.
+    type: str
+  history_to:
+    description:
+    - Specifies the end time of the changes returned for I(history_from).
+    - Same format as I(history_at), defaults to now.
+    type: str
+notes:
+- The cache, snapshot and history files are created readable by their owner only, in a
+  directory created with the same permissions. A file that is not owned by the user running
+  the module or that is writable by others is ignored.
+- Changes made on other nodes of a shared storage pool cluster are not detected
+  by the cache fingerprint, they are only picked up once I(max_age) is reached.
+- Runtime changes of the client side of the mappings are not detected by the cache
+  fingerprint either, such as the client partition ID and name of a VSCSI adapter or the
+  status and flags of an NPIV adapter when its client logs in or out. Cached mappings
+  can report them stale for up to I(max_age).
 '''
 
 EXAMPLES = r'''
@@ -93,19 +314,327 @@ EXAMPLES = r'''
     component: npiv
     vadapter: vfchost0
 
+- name: Populate the mapping facts with the mapping information for
+        several client partitions
+  mapping_facts:
+    cpid: [7, 12, 19]
+
 - name: Populate the mapping facts with the mapping information for
         optical backing devices
   mapping_facts:
     types: optical
+
+- name: Gather the mapping facts, reusing those cached in the last 10 minutes
+        if the device configuration did not change
+  mapping_facts:
+    cache: true
+    max_age: 600
+
+- name: Only gather the client ID and backing device of VSCSI mappings and
+        the status of NPIV mappings
+  mapping_facts:
+    gather_subset: [vscsi, npiv]
+    fields:
+      vscsi: [clientid, backing]
+      npiv: [status]
+
+- name: Gather the VSCSI mappings with the size, PVID, unique ID and reserve
+        policy of the backing devices
+  mapping_facts:
+    component: vscsi
+    enrich: backing
+
+- name: Gather the NPIV mappings with the WWPN and NPIV capacity of the
+        physical fibre channel ports
+  mapping_facts:
+    component: npiv
+    enrich: npiv
+
+- name: Gather the mapping facts as compact column arrays
+  mapping_facts:
+    format: columnar
+- name: Print the backing device and status of each VSCSI virtual target device
+  debug:
+    msg: "{{ vscsi.columns.vtd[item] }}: {{ vscsi.columns.backing[item] }}
+          {{ vscsi.strings[vscsi.columns.status[item]] }}"
+  loop: "{{ range(vscsi.rows) | list }}"
+  vars:
+    vscsi: "{{ ansible_facts.mappings.vscsi }}"
+
+- name: Report the stale VSCSI and NPIV configuration
+  mapping_facts:
+    gather_subset: [vscsi, npiv]
+    consistency: true
+  register: result
+- debug:
+    var: result.anomalies
+
+- name: Find the VTD mapping hdisk42
+  mapping_facts:
+    indexes: backing
+- debug:
+    var: ansible_facts.mapping_indexes.backing.hdisk42
+
+- name: Export the virtualization topology as GraphML
+  mapping_facts:
+    graph_file: /tmp/topology.graphml
+    graph_format: graphml
+
+- name: Gather the mapping facts and keep them in the history store for 90 days
+  mapping_facts:
+    history: true
+    history_retention: 90
+
+- name: Return the mapping changes of the last week from the history store
+  mapping_facts:
+    history_from: "{{ '%Y-%m-%d' | strftime(ansible_date_time.epoch | int - 7 * 86400) }}"
+
+- name: Gather the mapping changes since the previous run
+  mapping_facts:
+    delta: true
+    since: "{{ previous.snapshot_id | default(omit) }}"
+  register: previous
 '''
 
 RETURN = r'''
+anomalies:
+  description:
+  - Stale configuration found by I(consistency=true).
+  - Paths are lists of keys into the I(mappings) facts.
+  returned: if I(consistency=true)
+  type: dict
+  contains:
+    missing_backing:
+      description: Virtual target devices whose backing device does not exist anymore.
+      type: list
+      elements: dict
+      returned: always
+    free_disks_reserve_policy:
+      description:
+      - Disks that are neither mapped nor in a volume group and have a reserve_policy other
+        than C(no_reserve), with that policy.
+      - Such a disk takes a reservation when it is opened, for instance once mapped, that
+        blocks the other VIOS of the pair. C(single_path) is the AIX default for many disks,
+        set C(no_reserve) before mapping them from both VIOS.
+      type: list
+      elements: dict
+      returned: always
+    adapters_without_client:
+      description: Paths of the C(vscsi) and C(npiv) server adapters with no client partition.
+      type: list
+      elements: list
+      returned: always
+    duplicate_backings:
+      description: Backing devices mapped by more than one virtual target device, with
+        the paths of these devices.
+      type: dict
+      returned: always
+  sample:
+    "anomalies": {
+        "adapters_without_client": [["vscsi", "vhost3"]],
+        "duplicate_backings": {
+            "hdisk7": [["vscsi", "vhost0", "vtds", "vtscsi3"], ["vscsi", "vhost1", "vtds", "vtscsi5"]]
+        },
+        "missing_backing": [
+            {"path": ["vscsi", "vhost2", "vtds", "vtscsi4"], "backing": "hdisk12"}
+        ],
+        "free_disks_reserve_policy": [
+            {"name": "hdisk9", "reserve_policy": "single_path"}
+        ]
+    }
+stats:
+  description:
+  - Statistics of the commands run, by component.
+  - For C(cluster) and C(cluster_nodes), the cluster lookup command is in I(lookup_cmd),
+    I(lookup_rc) and I(lookup_time).
+  - For C(cluster_nodes), I(cmd) is the node listing command and the statistics of
+    the lsmap command of each node are in I(nodes).
+  returned: if I(stats=true)
+  type: dict
+  contains:
+    cmd:
+      description: Command run.
+      type: str
+      returned: always
+    rc:
+      description: Return code of the command.
+      type: int
+      returned: always
+    wall_time:
+      description: Wall time of the command in seconds, parsing included.
+      type: float
+      returned: always
+    parse_time:
+      description: Time spent parsing the output in seconds.
+      type: float
+      returned: always
+    records:
+      description: Number of records parsed.
+      type: int
+      returned: always
+    skipped:
+      description: Number of records skipped as malformed.
+      type: int
+      returned: always
+    rc_ignored:
+      description: Whether a non-zero return code was expected and ignored, for instance
+        when the VIOS has no adapter of the component.
+      type: bool
+      returned: always
+  sample:
+    "stats": {
+        "ams": {
+            "cmd": "/usr/ios/cli/ioscli lsmap -ams -all -fmt ,",
+            "rc": 69,
+            "wall_time": 0.412,
+            "parse_time": 0.0,
+            "records": 0,
+            "skipped": 0,
+            "rc_ignored": true
+        },
+        "vscsi": {
+            "cmd": "/usr/ios/cli/ioscli lsmap -all -fmt ,",
+            "rc": 0,
+            "wall_time": 0.785,
+            "parse_time": 0.003,
+            "records": 42,
+            "skipped": 0,
+            "rc_ignored": false
+        }
+    }
+cache_hit:
+  description:
+  - Whether the mappings were returned from the cache.
+  returned: if I(cache=true)
+  type: bool
+snapshot_id:
+  description:
+  - Identifier of the snapshot of the mappings, to pass as I(since) to the next run.
+  returned: if I(delta=true) or I(history=true)
+  type: str
+  sample: 3f786850e387550fdab836ed7e6dc881de23001b
+delta:
+  description:
+  - Changes of the mappings since the snapshot given by I(since).
+  - Paths are lists of keys into the I(mappings) facts, for instance
+    C([vscsi, vhost0, vtds, vtscsi2]).
+  returned: if I(delta=true) and I(since) matches the kept snapshot
+  type: dict
+  contains:
+    added:
+      description: Added adapters, VTDs or attributes, with their value.
+      type: list
+      elements: dict
+      returned: always
+    removed:
+      description: Paths of the removed adapters, VTDs or attributes.
+      type: list
+      elements: list
+      returned: always
+    modified:
+      description: Modified attributes, with their new value.
+      type: list
+      elements: dict
+      returned: always
+  sample:
+    "delta": {
+        "added": [
+            {"path": ["vscsi", "vhost0", "vtds", "vtscsi3"],
+             "value": {"backing": "hdisk7", "lun": "0x8300000000000000", "status": "Available"}}
+        ],
+        "modified": [
+            {"path": ["npiv", "vfchost18", "status"], "value": "NOT_LOGGED_IN"}
+        ],
+        "removed": [
+            ["vscsi", "vhost0", "vtds", "vtscsi2"]
+        ]
+    }
+history:
+  description:
+  - For I(history_at), the mappings at that time in I(mappings), with the time and
+    identifier of the snapshot they were gathered in.
+  - For I(history_from), the times and identifiers of the snapshots at both ends, the
+    times the mappings changed in between in I(changes) and the changes in I(delta),
+    in the same format as the I(delta) return value.
+  returned: if I(history_at) or I(history_from) is set
+  type: dict
+  sample:
+    "history": {
+        "from_time": 1718870400,
+        "from_snapshot_id": "3f786850e387550fdab836ed7e6dc881de23001b",
+        "to_time": 1719475200,
+        "to_snapshot_id": "89e6c98d92887913cadf06b2adb97f26cde4849b",
+        "changes": [1719475200],
+        "delta": {
+            "added": [],
+            "modified": [
+                {"path": ["npiv", "vfchost18", "status"], "value": "NOT_LOGGED_IN"}
+            ],
+            "removed": []
+        }
+    }
 ansible_facts:
   description:
   - Facts to add to ansible_facts about the mapping between physical, logical, and virtual devices.
   returned: always
   type: complex
   contains:
+    mapping_indexes:
+      description:
+      - Reverse lookup tables requested by I(indexes).
+      - Each entry maps a value to the list of paths, as lists of keys into the I(mappings)
+        facts, of the adapters or virtual target devices that reference it.
+      returned: if I(indexes) is set
+      type: dict
+      sample:
+        "mapping_indexes": {
+            "backing": {
+                "hdisk4": [["vscsi", "vhost0", "vtds", "vtscsi0"]]
+            },
+            "client": {
+                "19": [["npiv", "vfchost18"], ["vscsi", "vhost1"]]
+            },
+            "fc": {
+                "fcs1": [["npiv", "vfchost18"]]
+            },
+            "physloc": {
+                "U8284.22A.21FD4BV-V1-C26": [["npiv", "vfchost18"]],
+                "U78CD.001.FZH1998-P1-C6-T2": [["npiv", "vfchost18"]]
+            }
+        }
+    mapping_graph:
+      description:
+      - Virtualization topology graph, if I(graph=true).
+      - I(nodes) maps node identifiers to their type, name and attributes, I(adjacency)
+        and I(reverse_adjacency) map node identifiers to the identifiers of their
+        successors and predecessors.
+      - Adapters without client partition (ID 0) have no C(client) node.
+      - Node types are C(client), C(vscsi_adapter), C(npiv_adapter), C(net_adapter),
+        C(vnic_adapter), C(paging_device), C(suspend_adapter), C(cluster_adapter),
+        C(vtd), C(backing_device), C(sea), C(fc_port) and C(location).
+      returned: if I(graph=true)
+      type: dict
+      sample:
+        "mapping_graph": {
+            "nodes": {
+                "client:19": {"type": "client", "name": "19", "attributes": {}},
+                "npiv_adapter:vfchost18": {"type": "npiv_adapter", "name": "vfchost18",
+                                           "attributes": {"status": "LOGGED_IN", "physloc": "U8284.22A.21FD4BV-V1-C26"}},
+                "fc_port:fcs1": {"type": "fc_port", "name": "fcs1", "attributes": {}},
+                "location:U78CD.001.FZH1998-P1-C6-T2": {"type": "location", "name": "U78CD.001.FZH1998-P1-C6-T2",
+                                                        "attributes": {}}
+            },
+            "adjacency": {
+                "client:19": ["npiv_adapter:vfchost18"],
+                "npiv_adapter:vfchost18": ["fc_port:fcs1"],
+                "fc_port:fcs1": ["location:U78CD.001.FZH1998-P1-C6-T2"]
+            },
+            "reverse_adjacency": {
+                "npiv_adapter:vfchost18": ["client:19"],
+                "fc_port:fcs1": ["npiv_adapter:vfchost18"],
+                "location:U78CD.001.FZH1998-P1-C6-T2": ["fc_port:fcs1"]
+            }
+        }
     mappings:
       description:
       - Contains mappings for NPIV, VSCSI, SEA, VNIC, AMS, SSP and suspend.
@@ -175,6 +704,26 @@ ansible_facts:
               - Client virtual fibre channel adapter used for Dynamic Reconfiguration Connection (DRC).
               returned: when available
               type: str
+            fcport:
+              description:
+              - Physical fibre channel port information, shared by all the adapters mapped to
+                the port.
+              - I(wwpn) is the worldwide port name of the physical port, I(fabric) whether the
+                port is attached to a fabric that supports NPIV, I(tports) and I(aports) the
+                total and available number of NPIV ports, I(swwpns) and I(awwpns) the supported
+                and available number of client worldwide port names.
+              returned: if I(enrich) contains C(npiv) and the adapter is mapped to a port
+              type: dict
+              sample:
+                "fcport": {
+                    "aports": 61,
+                    "awwpns": 2032,
+                    "fabric": true,
+                    "physloc": "U78CD.001.FZH1998-P1-C6-T2",
+                    "swwpns": 2048,
+                    "tports": 64,
+                    "wwpn": "10000090FA1B2C3D"
+                }
           sample:
             "npiv": {
                 "vfchost18": {
@@ -277,6 +826,19 @@ ansible_facts:
                   - The backing device is part of a Peer-to-Peer Remote Copy (PPRC) pair.
                   returned: when available
                   type: bool
+                attributes:
+                  description:
+                  - Attributes of the backing device, I(size) in megabytes, I(pvid),
+                    I(unique_id) and I(reserve_policy), when they apply to the device.
+                  returned: if I(enrich) contains C(backing)
+                  type: dict
+                  sample:
+                    "attributes": {
+                        "pvid": "00f6db0a6c7aece5",
+                        "reserve_policy": "no_reserve",
+                        "size": 51200,
+                        "unique_id": "33213600507680C80010D90000000000012D604214503IBMfcp"
+                    }
                 status:
                   description:
                   - Virtual target device status.
@@ -490,6 +1052,19 @@ ansible_facts:
                   - The backing device is part of a Peer-to-Peer Remote Copy (PPRC) pair.
                   returned: when available
                   type: bool
+                attributes:
+                  description:
+                  - Attributes of the backing device, I(size) in megabytes, I(pvid),
+                    I(unique_id) and I(reserve_policy), when they apply to the device.
+                  returned: if I(enrich) contains C(backing)
+                  type: dict
+                  sample:
+                    "attributes": {
+                        "pvid": "00f6db0a6c7aece5",
+                        "reserve_policy": "no_reserve",
+                        "size": 51200,
+                        "unique_id": "33213600507680C80010D90000000000012D604214503IBMfcp"
+                    }
           sample:
             "suspend": {
                 "susadpt0": {
@@ -564,13 +1139,65 @@ ansible_facts:
                     }
                 }
             }
+        cluster_nodes:
+          description:
+          - Maps cluster name and node name to the shared storage pool mappings of the node,
+            with the same layout as I(cluster).
+          - C(errmsg) is set instead for a node whose mappings could not be retrieved.
+          returned: if I(cluster_nodes=true)
+          type: dict
+          sample:
+            "cluster_nodes": {
+                "mycluster": {
+                    "vios1": {
+                        "U8233.E8B.HV32001-V2-C2": {
+                            "clientid": 0,
+                            "vtds": {
+                                "vtscsi0": {
+                                    "backing": "testLU1.b1277fffdd5f38acb365413b55e51638",
+                                    "lun": "0x8100000000000000"
+                                }
+                            }
+                        }
+                    },
+                    "vios2": {
+                        "errmsg": "Node is not reachable."
+                    }
+                }
+            }
 '''
 
+import gzip
+import hashlib
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import (
+    delimiter, parse_vscsi, parse_npiv, parse_net, parse_vnic, parse_ams, parse_suspend, parse_cluster,
+    split_record, stream_lsmap, is_lu_backing,
+)
+from ansible_collections.ibm.power_vios.plugins.module_utils.state import read_state, write_state, UntrustedStateError
 
 
 ioscli_cmd = '/usr/ios/cli/ioscli'
-delimiter = ','  # Delimiter to use for lsmap -fmt
+lsdev_cmd = '/usr/sbin/lsdev'
+odmget_cmd = '/usr/bin/odmget'
+# ODM customized device classes updated on any device configuration change
+odm_files = ['/etc/objrepos/CuDv', '/etc/objrepos/CuAt', '/etc/objrepos/CuDep']
+components = ['vscsi', 'ams', 'suspend', 'npiv', 'net', 'vnic', 'cluster']
+# Key columns of the columnar format, by component
+table_keys = dict(cluster=['cluster', 'physloc'], cluster_nodes=['cluster', 'node', 'physloc'])
+# Columns of the columnar format with few distinct values, stored as indexes into a string table
+interned_columns = frozenset(['adapter', 'cluster', 'node', 'physloc', 'status', 'state', 'clntname', 'clntos',
+                              'clientname', 'fc', 'fcphysloc', 'vfcclient', 'sea', 'poolid', 'vasi', 'pager',
+                              'lun', 'attributes.reserve_policy', 'fcport.physloc', 'fcport.wwpn'])
+# Attributes of the virtual target devices
+vtd_fields = frozenset(['status', 'lun', 'backing', 'bdphysloc', 'mirrored'])
 results = dict(
     changed=False,
     cmd='',
@@ -578,228 +1205,277 @@ results = dict(
     stdout='',
     stderr='',
 )
+# Statistics of the commands run, by component
+stats = {}
 
 
-def vscsi_mappings(module, mappings):
+def new_stats(module, component, node=None):
     """
-    Retrieve VSCSI mappings.
+    Return the statistics entry of a component (or of a node of the cluster)
+    to be filled by run_lsmap, or None if statistics are not requested.
     """
-    cmd = [ioscli_cmd, 'lsmap']
-    if module.params['vadapter']:
-        cmd += ['-vadapter', module.params['vadapter']]
-    elif module.params['physloc']:
-        cmd += ['-plc', module.params['physloc']]
+    if not module.params['stats']:
+        return None
+    stat = dict(cmd='', rc=None, wall_time=0.0, parse_time=0.0, records=0, skipped=0, rc_ignored=False)
+    if node is None:
+        stats[component] = stat
+    else:
+        stats[component].setdefault('nodes', {})[node] = stat
+    return stat
+
+
+def ignore_rc(component, node=None):
+    """
+    Record in the statistics that the non-zero return code of the lsmap
+    command of a component (or of a node of the cluster) was expected and
+    ignored.
+    """
+    if component not in stats:
+        return
+    if node is None:
+        stats[component]['rc_ignored'] = True
+    else:
+        stats[component]['nodes'][node]['rc_ignored'] = True
+
+
+def component_required(module, component):
+    """
+    Check if the component is the only one requested, through gather_subset
+    or component, in which case a VIOS without adapter of the component is
+    an error rather than an empty result.
+    """
+    return selected_components(module) == set([component])
+
+
+def project_record(record, keep):
+    """
+    Remove from a record the attributes that are not in keep, the virtual
+    target devices are removed if none of their attributes is kept.
+    """
+    for key in list(record):
+        if key == 'vtds' and keep.intersection(vtd_fields):
+            for vtd in record['vtds'].values():
+                for vtd_key in list(vtd):
+                    if vtd_key not in keep:
+                        del vtd[vtd_key]
+        elif key not in keep:
+            del record[key]
+
+
+def add_selection(module, cmd, physloc=True, cpid=True):
+    """
+    Add the server adapter and client partition selection options to an
+    lsmap command.
+    A single value is passed to lsmap, several values are selected by
+    running lsmap -all once and filtering its output, which is cheaper than
+    one ioscli command per value.
+    Return the selection to apply to the records, as a dict of attribute
+    name to set of values.
+    """
+    vadapters = module.params['vadapter'] or []
+    physlocs = (module.params['physloc'] or []) if physloc else []
+    cpids = (module.params['cpid'] or []) if cpid else []
+
+    selection = {}
+    if len(vadapters) == 1:
+        cmd += ['-vadapter', vadapters[0]]
+    elif len(physlocs) == 1:
+        cmd += ['-plc', physlocs[0]]
     else:
         cmd += ['-all']
-    if module.params['cpid']:
-        cmd += ['-cpid', module.params['cpid']]
+        if vadapters:
+            selection['name'] = set(vadapters)
+        elif physlocs:
+            selection['physloc'] = set(physlocs)
+    if len(cpids) == 1:
+        cmd += ['-cpid', cpids[0]]
+    elif cpids:
+        selection['clientid'] = set(int(clientid) for clientid in cpids)
+    return selection
+
+
+def is_selected(name, record, selection):
+    """
+    Check if a record matches the selection built by add_selection.
+    """
+    if 'name' in selection and name not in selection['name']:
+        return False
+    if 'physloc' in selection and record.get('physloc') not in selection['physloc']:
+        return False
+    if 'clientid' in selection and record.get('clientid', record.get('clntid')) not in selection['clientid']:
+        return False
+    return True
+
+
+def run_lsmap(module, component, cmd, parse_record, min_fields, selection=None, stat=None):
+    """
+    Run an lsmap command and parse its output one record at a time, as the
+    command produces it, so that the whole output is never held in memory.
+    Lines with less than min_fields fields or that cannot be parsed are not
+    records, the first ones are returned as stdout.
+    Only the records matching the selection and the attributes requested by
+    the fields option are kept.
+    The command, its wall time, the time spent parsing and the number of
+    parsed and skipped lines are recorded in stat if provided.
+    Return a tuple (rc, records, stdout, stderr).
+    """
+    keep = (module.params['fields'] or {}).get(component)
+    if keep is not None:
+        keep = set(keep)
+    records = {}
+    counts = dict(parsed=0, skipped=0, parse_time=0.0)
+
+    def parse_line(line):
+        parse_start = time.perf_counter()
+        fields = split_record(line, min_fields)
+        if fields is None:
+            return False
+        try:
+            parse_record(fields, records)
+            # All parsers key their records by the first field
+            if selection and not is_selected(fields[0], records[fields[0]], selection):
+                del records[fields[0]]
+            elif keep is not None:
+                project_record(records[fields[0]], keep)
+            counts['parsed'] += 1
+            return True
+        except (ValueError, IndexError):
+            counts['skipped'] += 1
+            return False
+        finally:
+            counts['parse_time'] += time.perf_counter() - parse_start
+
+    start = time.perf_counter()
+    ret, stdout, stderr = stream_lsmap(module, cmd, parse_line)
+    if stat is not None:
+        stat.update(cmd=' '.join(cmd), rc=ret, wall_time=round(time.perf_counter() - start, 6),
+                    parse_time=round(counts['parse_time'], 6), records=counts['parsed'], skipped=counts['skipped'])
+    return ret, records, stdout, stderr
+
+
+def lsmap_failed(module, ret, stdout, stderr):
+    """
+    Fail the module with the output of the lsmap command.
+    """
+    results['msg'] = f'lsmap failed rc={ret}'
+    results['stdout'] = stdout
+    results['stderr'] = stderr
+    module.fail_json(**results)
+
+
+def lsmap_vscsi(module):
+    """
+    Run lsmap for VSCSI mappings.
+    """
+    cmd = [ioscli_cmd, 'lsmap']
+    selection = add_selection(module, cmd)
     if module.params['types']:
         cmd += ['-type']
         cmd += module.params['types']
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return run_lsmap(module, 'vscsi', cmd, parse_vscsi, 9, selection, new_stats(module, 'vscsi'))
+
+
+def vscsi_mappings(module, mappings, output=None):
+    """
+    Retrieve VSCSI mappings.
+    The output of lsmap_vscsi can be passed if the command was already run.
+    """
+    ret, records, stdout, stderr = output if output is not None else lsmap_vscsi(module)
     if ret != 0:
-        if (ret == 10 or ret == 15) and module.params['component'] != 'vscsi':
+        if (ret == 10 or ret == 15) and not component_required(module, 'vscsi'):
+            ignore_rc('vscsi')
             return  # E_NODEVPHYSLOC or E_NOTSVSA_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap:
-    # svsa:physloc:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
-    mappings['vscsi'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 9:
-            continue
-        fields = [field.strip() for field in raw_fields]
-
-        svsa = fields[0]
-        mapping = {}
-        mapping['physloc'] = fields[1]
-        # Do the hexadecimal conversion ourselves as not all VIOS levels
-        # support lsmap -dec option.
-        mapping['clientid'] = int(fields[2], 16)
-        mapping['vtds'] = {}
-        for i in range(3, len(fields), 6):
-            if not fields[i]:
-                break
-            vtd = {}
-            vtd['status'] = fields[i + 1]
-            vtd['lun'] = fields[i + 2]
-            if fields[i + 3]:
-                vtd['backing'] = fields[i + 3]
-            if fields[i + 4]:
-                vtd['bdphysloc'] = fields[i + 4]
-            if fields[i + 5] != 'N/A':
-                vtd['mirrored'] = fields[i + 5] != 'false'
-
-            mapping['vtds'][fields[i]] = vtd
-        mappings['vscsi'][svsa] = mapping
-
-
-def npiv_mappings(module, mappings):
+    mappings['vscsi'] = records
+
+
+def lsmap_npiv(module):
     """
-    Retrieve NPIV mappings.
+    Run lsmap for NPIV mappings.
     """
     cmd = [ioscli_cmd, 'lsmap', '-npiv']
-    if module.params['vadapter']:
-        cmd += ['-vadapter', module.params['vadapter']]
-    elif module.params['physloc']:
-        cmd += ['-plc', module.params['physloc']]
-    else:
-        cmd += ['-all']
-    if module.params['cpid']:
-        cmd += ['-cpid', module.params['cpid']]
+    selection = add_selection(module, cmd)
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return run_lsmap(module, 'npiv', cmd, parse_npiv, 12, selection, new_stats(module, 'npiv'))
+
+
+def npiv_mappings(module, mappings, output=None):
+    """
+    Retrieve NPIV mappings.
+    The output of lsmap_npiv can be passed if the command was already run.
+    """
+    ret, records, stdout, stderr = output if output is not None else lsmap_npiv(module)
     if ret != 0:
-        if (ret == 10 or ret == 63) and module.params['component'] != 'npiv':
+        if (ret == 10 or ret == 63) and not component_required(module, 'npiv'):
+            ignore_rc('npiv')
             return  # E_NODEVPHYSLOC or E_NOTSVFCA_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap -npiv:
-    # name:physloc:clntid:clntname:clntos:status:fc:fcphysloc:ports:flags:vfcclient:vfcclientdrc
-    mappings['npiv'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 12:
-            continue
-        fields = [field.strip() for field in raw_fields]
-
-        name = fields[0]
-        mapping = {}
-        mapping['physloc'] = fields[1]
-        mapping['clntid'] = int(fields[2])
-        if fields[3]:
-            mapping['clntname'] = fields[3]
-        if fields[4]:
-            mapping['clntos'] = fields[4]
-        mapping['status'] = fields[5]
-        if fields[6]:
-            mapping['fc'] = fields[6]
-        if fields[7]:
-            mapping['fcphysloc'] = fields[7]
-        mapping['ports'] = int(fields[8])
-        mapping['flags'] = int(fields[9], 16)
-        if fields[10]:
-            mapping['vfcclient'] = fields[10]
-        if fields[11]:
-            mapping['vfcclientdrc'] = fields[11]
-
-        mappings['npiv'][name] = mapping
-
-
-def net_mappings(module, mappings):
+    mappings['npiv'] = records
+
+
+def lsmap_net(module):
     """
-    Retrieve SEA mappings.
+    Run lsmap for SEA mappings.
     """
     cmd = [ioscli_cmd, 'lsmap', '-net']
-    if module.params['vadapter']:
-        cmd += ['-vadapter', module.params['vadapter']]
-    elif module.params['physloc']:
-        cmd += ['-plc', module.params['physloc']]
-    else:
-        cmd += ['-all']
+    selection = add_selection(module, cmd, cpid=False)
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return run_lsmap(module, 'net', cmd, parse_net, 6, selection, new_stats(module, 'net'))
+
+
+def net_mappings(module, mappings, output=None):
+    """
+    Retrieve SEA mappings.
+    The output of lsmap_net can be passed if the command was already run.
+    """
+    ret, records, stdout, stderr = output if output is not None else lsmap_net(module)
     if ret != 0:
-        if (ret == 10 or ret == 16) and module.params['component'] != 'net':
+        if (ret == 10 or ret == 16) and not component_required(module, 'net'):
+            ignore_rc('net')
             return  # E_NODEVPHYSLOC or E_NOTSVEA_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap -net:
-    # svea:physloc:sea:backing:status:bdphysloc
-    mappings['net'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 6:
-            continue
-        fields = [field.strip() for field in raw_fields]
+    mappings['net'] = records
 
-        svea = fields[0]
-        mapping = {}
-        mapping['physloc'] = fields[1]
-        if fields[2]:
-            mapping['sea'] = fields[2]
-        if fields[3]:
-            mapping['backing'] = fields[3]
-        if fields[4]:
-            mapping['status'] = fields[4]
-        if fields[5]:
-            mapping['bdphysloc'] = fields[5]
 
-        mappings['net'][svea] = mapping
+def lsmap_vnic(module):
+    """
+    Run lsmap for VNIC mappings.
+    """
+    cmd = [ioscli_cmd, 'lsmap', '-vnic']
+    selection = add_selection(module, cmd)
+    cmd += ['-fmt', delimiter]
+    return run_lsmap(module, 'vnic', cmd, parse_vnic, 10, selection, new_stats(module, 'vnic'))
 
 
-def vnic_mappings(module, mappings):
+def vnic_mappings(module, mappings, output=None):
     """
     Retrieve VNIC mappings.
+    The output of lsmap_vnic can be passed if the command was already run.
     """
-    cmd = [ioscli_cmd, 'lsmap', '-vnic']
-    if module.params['vadapter']:
-        cmd += ['-vadapter', module.params['vadapter']]
-    elif module.params['physloc']:
-        cmd += ['-plc', module.params['physloc']]
-    else:
-        cmd += ['-all']
-    if module.params['cpid']:
-        cmd += ['-cpid', module.params['cpid']]
-    cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    ret, records, stdout, stderr = output if output is not None else lsmap_vnic(module)
     if ret != 0:
         if 'Option flag is not valid' in stderr:
+            ignore_rc('vnic')
             return  # Ignore if lsmap -vnic option is not supported
-        if (ret == 10 or ret == 88) and module.params['component'] != 'vnic':
+        if (ret == 10 or ret == 88) and not component_required(module, 'vnic'):
+            ignore_rc('vnic')
             return  # E_NODEVPHYSLOC or E_NOT_SVNIC_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap -vnic:
-    # name:physloc:clntid:clntname:clntos:backing:status:bdphysloc:clntdev:clntphysloc
-    mappings['vnic'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 10:
-            continue
-        fields = [field.strip() for field in raw_fields]
-
-        name = fields[0]
-        mapping = {}
-        mapping['physloc'] = fields[1]
-        if fields[2] != 'N/A':
-            mapping['clntid'] = int(fields[2])
-        if fields[3] != 'N/A':
-            mapping['clntname'] = fields[3]
-        if fields[4] != 'N/A':
-            mapping['clntos'] = fields[4]
-        if fields[5] != 'N/A':
-            mapping['backing'] = fields[5]
-        mapping['status'] = fields[6]
-        mapping['bdphysloc'] = fields[7]
-        if fields[8] != 'N/A':
-            mapping['clntdev'] = fields[8]
-        mapping['clntphysloc'] = fields[9]
-
-        mappings['vnic'][name] = mapping
-
-
-def ams_mappings(module, mappings):
+    mappings['vnic'] = records
+
+
+def lsmap_ams(module):
     """
-    Retrieve AMS mappings.
+    Run lsmap for AMS mappings.
     """
     cmd = [ioscli_cmd, 'lsmap', '-ams']
     if module.params['vtd']:
@@ -810,118 +1486,79 @@ def ams_mappings(module, mappings):
         cmd += ['-type']
         cmd += module.params['types']
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return run_lsmap(module, 'ams', cmd, parse_ams, 10, stat=new_stats(module, 'ams'))
+
+
+def ams_mappings(module, mappings, output=None):
+    """
+    Retrieve AMS mappings.
+    The output of lsmap_ams can be passed if the command was already run.
+    """
+    ret, records, stdout, stderr = output if output is not None else lsmap_ams(module)
     if ret != 0:
-        if ret == 69 and module.params['component'] != 'ams':
+        if ret == 69 and not component_required(module, 'ams'):
+            ignore_rc('ams')
             return  # E_NOTSVPD_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap -ams:
-    # paging:streamid:clientid:status:redundancy:backing:poolid:vasi:pager:vbsd
-    mappings['ams'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 10:
-            continue
-        fields = [field.strip() for field in raw_fields]
-
-        paging = fields[0]
-        mapping = {}
-        mapping['streamid'] = fields[1]
-        # Do the hexadecimal conversion ourselves as not all VIOS levels
-        # support lsmap -dec option.
-        mapping['clntid'] = int(fields[2], 16)
-        mapping['status'] = fields[3]
-        mapping['redundancy'] = fields[4] != 'no'
-        mapping['backing'] = fields[5]
-        mapping['poolid'] = fields[6]
-        if fields[7]:
-            mapping['vasi'] = fields[7]
-        if fields[8]:
-            mapping['pager'] = fields[8]
-        if fields[9]:
-            mapping['vbsd'] = fields[9]
-
-        mappings['ams'][paging] = mapping
-
-
-def suspend_mappings(module, mappings):
+    mappings['ams'] = records
+
+
+def lsmap_suspend(module):
     """
-    Retrieve suspend mappings.
+    Run lsmap for suspend mappings.
     """
     cmd = [ioscli_cmd, 'lsmap', '-suspend']
-    if module.params['vadapter']:
-        cmd += ['-vadapter', module.params['vadapter']]
-    else:
-        cmd += ['-all']
+    selection = add_selection(module, cmd, physloc=False, cpid=False)
     if module.params['types']:
         cmd += ['-type']
         cmd += module.params['types']
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return run_lsmap(module, 'suspend', cmd, parse_suspend, 11, selection, new_stats(module, 'suspend'))
+
+
+def suspend_mappings(module, mappings, output=None):
+    """
+    Retrieve suspend mappings.
+    The output of lsmap_suspend can be passed if the command was already run.
+    """
+    ret, records, stdout, stderr = output if output is not None else lsmap_suspend(module)
     if ret != 0:
-        if ret == 15 and module.params['component'] != 'suspend':
+        if ret == 15 and not component_required(module, 'suspend'):
+            ignore_rc('suspend')
             return  # E_NOTSVSA_S
 
-        results['msg'] = f'lsmap failed rc={ret}'
-        results['stdout'] = stdout
-        results['stderr'] = stderr
-        module.fail_json(**results)
+        lsmap_failed(module, ret, stdout, stderr)
 
-    # List of fields returned by lsmap -suspend:
-    # svsa:state:clientname:streamid:clientid(:vtd:status:lun:backing:bdphysloc:mirrored)+
-    mappings['suspend'] = {}
-    for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 11:
-            continue
-        fields = [field.strip() for field in raw_fields]
-
-        svsa = fields[0]
-        mapping = {}
-        mapping['state'] = fields[1]
-        if fields[2]:
-            mapping['clientname'] = fields[2]
-        mapping['streamid'] = fields[3]
-        # Do the hexadecimal conversion ourselves as not all VIOS levels
-        # support lsmap -dec option.
-        mapping['clientid'] = int(fields[4], 16)
-        mapping['vtds'] = {}
-        for i in range(5, len(fields), 6):
-            if not fields[i]:
-                break
-            vtd = {}
-            vtd['status'] = fields[i + 1]
-            vtd['lun'] = fields[i + 2]
-            if fields[i + 3]:
-                vtd['backing'] = fields[i + 3]
-            if fields[i + 4]:
-                vtd['bdphysloc'] = fields[i + 4]
-            if fields[i + 5] != 'N/A':
-                vtd['mirrored'] = fields[i + 5] != 'false'
-
-            mapping['vtds'][fields[i]] = vtd
-        mappings['suspend'][svsa] = mapping
-
-
-def cluster_mappings(module, mappings):
+    mappings['suspend'] = records
+
+
+def find_cluster(module, stat=None):
     """
-    Retrieve cluster SSP mappings.
+    Return the name of the cluster the VIOS is part of, or None.
+    The command and its wall time are recorded in stat if provided.
     """
-    mappings['cluster'] = {}
-
-    # Check if VIOS is part of a cluster
     cmd = [ioscli_cmd, 'cluster', '-list', '-field', 'cluster_name', '-fmt', ',']
+    start = time.perf_counter()
     ret, stdout, stderr = module.run_command(cmd)
-    if ret != 0:
-        return  # assume no cluster found
-    clustername = stdout.splitlines()[0]
+    if stat is not None:
+        stat.update(lookup_cmd=' '.join(cmd), lookup_rc=ret, lookup_time=round(time.perf_counter() - start, 6))
+    if ret != 0 or not stdout.strip():
+        return None
+    return stdout.splitlines()[0]
 
-    mappings['cluster'][clustername] = {}
+
+def lsmap_cluster(module):
+    """
+    Run lsmap for cluster SSP mappings.
+    Return the cluster name and the lsmap output, or None if the VIOS is not
+    part of a cluster.
+    """
+    stat = new_stats(module, 'cluster')
+    clustername = find_cluster(module, stat)
+    if clustername is None:
+        return None  # assume no cluster found
 
     cmd = [ioscli_cmd, 'lsmap', '-clustername', clustername]
     if module.params['hostname']:
@@ -929,42 +1566,1036 @@ def cluster_mappings(module, mappings):
     else:
         cmd += ['-all']
     cmd += ['-fmt', delimiter]
-    ret, stdout, stderr = module.run_command(cmd)
+    return clustername, run_lsmap(module, 'cluster', cmd, parse_cluster, 5, stat=stat)
+
+
+def cluster_mappings(module, mappings, output=None):
+    """
+    Retrieve cluster SSP mappings.
+    The output of lsmap_cluster can be passed if the commands were already run.
+    """
+    mappings['cluster'] = {}
+
+    if output is None:
+        output = lsmap_cluster(module)
+    if output is None:
+        return
+    clustername, (ret, records, stdout, stderr) = output
+
+    mappings['cluster'][clustername] = {}
+
     if ret != 0:
-        if module.params['component'] != 'cluster':
+        if not component_required(module, 'cluster'):
+            ignore_rc('cluster')
             mappings['cluster'][clustername]['errmsg'] = stderr
             return
 
-        results['msg'] = f'lsmap failed rc={ret}'
+        lsmap_failed(module, ret, stdout, stderr)
+
+    mappings['cluster'][clustername] = records
+
+
+def lsmap_cluster_nodes(module):
+    """
+    Run lsmap for the cluster SSP mappings of each node of the cluster,
+    concurrently.
+    Return the cluster name, the output of the node listing and the lsmap
+    output of each node, or None if the VIOS is not part of a cluster.
+    """
+    stat = new_stats(module, 'cluster_nodes')
+    clustername = find_cluster(module, stat)
+    if clustername is None:
+        return None  # assume no cluster found
+
+    if module.params['hostname']:
+        nodes = [module.params['hostname']]
+        status = (0, '', '')
+    else:
+        cmd = [ioscli_cmd, 'cluster', '-status', '-clustername', clustername,
+               '-field', 'node_name', '-fmt', delimiter]
+        start = time.perf_counter()
+        status = module.run_command(cmd)
+        if stat is not None:
+            stat.update(cmd=' '.join(cmd), rc=status[0], wall_time=round(time.perf_counter() - start, 6))
+        if status[0] != 0:
+            return clustername, status, {}
+        nodes = [line.split(delimiter)[0].strip() for line in status[1].splitlines() if line.strip()]
+
+    outputs = {}
+    if not nodes:
+        return clustername, status, outputs
+    with ThreadPoolExecutor(max_workers=max(1, min(module.params['workers'], len(nodes)))) as executor:
+        futures = {}
+        for node in nodes:
+            cmd = [ioscli_cmd, 'lsmap', '-clustername', clustername, '-hostname', node, '-fmt', delimiter]
+            node_stat = new_stats(module, 'cluster_nodes', node)
+            futures[executor.submit(run_lsmap, module, 'cluster', cmd, parse_cluster, 5, stat=node_stat)] = node
+        for future in as_completed(futures):
+            outputs[futures[future]] = future.result()
+    return clustername, status, outputs
+
+
+def cluster_nodes_mappings(module, mappings, output=None):
+    """
+    Retrieve cluster SSP mappings of each node of the cluster.
+    The output of lsmap_cluster_nodes can be passed if the commands were already run.
+    """
+    mappings['cluster_nodes'] = {}
+
+    if output is None:
+        output = lsmap_cluster_nodes(module)
+    if output is None:
+        return
+    clustername, (ret, stdout, stderr), outputs = output
+
+    mappings['cluster_nodes'][clustername] = {}
+
+    if ret != 0:
+        if not component_required(module, 'cluster'):
+            ignore_rc('cluster_nodes')
+            mappings['cluster_nodes'][clustername]['errmsg'] = stderr
+            return
+
+        results['msg'] = f'cluster -status failed rc={ret}'
         results['stdout'] = stdout
         results['stderr'] = stderr
         module.fail_json(**results)
 
-    # List of fields returned by lsmap -clustername:
-    # physloc:clientid:vtd:lun:backing
-    physmap = {}
+    for node, (ret, records, stdout, stderr) in outputs.items():
+        if ret != 0:
+            ignore_rc('cluster_nodes', node)
+            mappings['cluster_nodes'][clustername][node] = dict(errmsg=stderr or stdout or f'lsmap failed rc={ret}')
+        else:
+            mappings['cluster_nodes'][clustername][node] = records
+
+
+def collect_mappings(module, collectors, mappings):
+    """
+    Run the lsmap commands of the collectors and parse their output into mappings.
+    The commands are run concurrently by a bounded pool of workers and each
+    output is parsed as soon as its command completes.
+    """
+    workers = min(module.params['workers'], len(collectors))
+    if workers <= 1:
+        for lsmap, parse in collectors:
+            parse(module, mappings, lsmap(module))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = dict((executor.submit(lsmap, module), parse) for lsmap, parse in collectors)
+        for future in as_completed(futures):
+            futures[future](module, mappings, future.result())
+
+
+def device_fingerprint(module):
+    """
+    Compute a cheap fingerprint of the device configuration, made of the
+    modification time of the ODM customized device classes and a digest of
+    the list of devices with their status.
+    The client side of the mappings, that changes at runtime, is not part of it.
+    Return None if the fingerprint cannot be computed.
+    """
+    fingerprint = {}
+    for odm_file in odm_files:
+        try:
+            fingerprint[odm_file] = os.stat(odm_file).st_mtime
+        except OSError:
+            fingerprint[odm_file] = None
+
+    ret, stdout, stderr = module.run_command([lsdev_cmd, '-C', '-F', 'name:status'])
+    if ret != 0:
+        return None
+    devices = stdout.splitlines()
+    fingerprint['devices'] = len(devices)
+    fingerprint['digest'] = hashlib.sha1(stdout.encode('utf-8')).hexdigest()
+    return fingerprint
+
+
+def cache_key(module):
+    """
+    Return the key of the cache entry matching the module options.
+    """
+    options = ['component', 'gather_subset', 'fields', 'vadapter', 'physloc', 'vtd', 'hostname', 'cluster_nodes',
+               'cpid', 'types', 'enrich']
+    return json.dumps([module.params[option] for option in options], sort_keys=True)
+
+
+def load_store(module, path, compressed=False):
+    """
+    Load a JSON store file, optionally gzip-compressed, return an empty store
+    if it does not exist, is not valid or cannot be trusted.
+    """
+    try:
+        content = read_state(path)
+        if content is None:
+            return {}
+        store = json.loads((gzip.decompress(content) if compressed else content).decode('utf-8'))
+    except UntrustedStateError as err:
+        module.warn(f'Ignoring untrusted file: {err}')
+        return {}
+    except (IOError, OSError, EOFError, ValueError):
+        return {}
+    if not isinstance(store, dict):
+        return {}
+    return store
+
+
+def save_store(module, path, store, compressed=False):
+    """
+    Atomically write a JSON store file, optionally gzip-compressed, warn if it
+    cannot be written. Nothing is written in check mode.
+    """
+    if module.check_mode:
+        return
+    if compressed:
+        content = gzip.compress(json.dumps(store, separators=(',', ':')).encode('utf-8'))
+    else:
+        content = json.dumps(store).encode('utf-8')
+    try:
+        write_state(path, content)
+    except (IOError, OSError) as err:
+        module.warn(f'Could not write file {path}: {err}')
+
+
+def cached_mappings(module, fingerprint):
+    """
+    Return the cached mappings if the fingerprint matches and the entry is
+    not older than max_age, None otherwise.
+    """
+    if fingerprint is None:
+        return None
+    entry = load_store(module, module.params['cache_file']).get(cache_key(module))
+    if not entry or entry.get('fingerprint') != fingerprint:
+        return None
+    if time.time() - entry.get('timestamp', 0) > module.params['max_age']:
+        return None
+    return entry.get('mappings')
+
+
+def save_cache(module, fingerprint, mappings):
+    """
+    Store the mappings along with the device configuration fingerprint.
+    """
+    if fingerprint is None:
+        return
+    cache = load_store(module, module.params['cache_file'])
+    cache[cache_key(module)] = dict(fingerprint=fingerprint,
+                                    timestamp=time.time(),
+                                    mappings=mappings)
+    save_store(module, module.params['cache_file'], cache)
+
+
+def snapshot_id(mappings):
+    """
+    Return the identifier of a snapshot of the mappings, derived from its content.
+    """
+    return hashlib.sha1(json.dumps(mappings, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def diff_mappings(old, new, path, delta):
+    """
+    Record in delta the keys added to, removed from or modified in new
+    compared to old, recursing into nested dicts.
+    """
+    for key, value in new.items():
+        if key not in old:
+            delta['added'].append(dict(path=path + [key], value=value))
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            diff_mappings(old[key], value, path + [key], delta)
+        elif value != old[key]:
+            delta['modified'].append(dict(path=path + [key], value=value))
+    for key in old:
+        if key not in new:
+            delta['removed'].append(path + [key])
+
+
+def delta_mappings(module, mappings, results):
+    """
+    Keep the mappings as the new snapshot and replace the mappings facts
+    by the changes since the snapshot given by the since option, if it is
+    the kept one.
+    """
+    snapshot_path = module.params['snapshot_file']
+    snapshots = load_store(module, snapshot_path)
+    key = cache_key(module)
+    current_id = snapshot_id(mappings)
+    previous = snapshots.get(key)
+
+    results['snapshot_id'] = current_id
+    if previous and module.params['since'] and previous.get('id') == module.params['since']:
+        delta = dict(added=[], removed=[], modified=[])
+        diff_mappings(previous.get('mappings', {}), mappings, [], delta)
+        results['delta'] = delta
+        results['ansible_facts'].pop('mappings', None)
+
+    if not previous or previous.get('id') != current_id:
+        snapshots[key] = dict(id=current_id, mappings=mappings)
+        save_store(module, snapshot_path, snapshots)
+
+
+def apply_delta(mappings, delta):
+    """
+    Apply to mappings, in place, the changes computed by diff_mappings.
+    """
+    for path in delta['removed']:
+        parent = mappings
+        for key in path[:-1]:
+            parent = parent[key]
+        del parent[path[-1]]
+    for change in delta['added'] + delta['modified']:
+        parent = mappings
+        for key in change['path'][:-1]:
+            parent = parent.setdefault(key, {})
+        parent[change['path'][-1]] = change['value']
+
+
+def history_state(series, timestamp=None):
+    """
+    Rebuild the mappings of a history series as they were at timestamp, or
+    at the last entry if timestamp is None.
+    Return a tuple (entry, mappings), entry is None if the series starts
+    after timestamp.
+    """
+    entries = series['entries']
+    if not entries or (timestamp is not None and entries[0]['time'] > timestamp):
+        return None, None
+    mappings = json.loads(json.dumps(series['base']))
+    entry = entries[0]
+    for following in entries[1:]:
+        if timestamp is not None and following['time'] > timestamp:
+            break
+        apply_delta(mappings, following['delta'])
+        entry = following
+    return entry, mappings
+
+
+def record_history(module, mappings):
+    """
+    Append the mappings to the history store if they changed since the last
+    entry, and drop the entries older than the retention period.
+    The first entry of a series holds the full mappings, the following ones
+    only the changes from their predecessor, so an unchanged snapshot only
+    updates the time it was last seen.
+    Return the snapshot identifier of the mappings.
+    """
+    history_path = module.params['history_file']
+    history = load_store(module, history_path, compressed=True)
+    now = int(time.time())
+    current_id = snapshot_id(mappings)
+    series = history.setdefault(cache_key(module), dict(base=None, entries=[], last_seen=None))
+
+    last = series['entries'][-1] if series['entries'] else None
+    if last is None:
+        series['base'] = mappings
+        series['entries'].append(dict(time=now, id=current_id))
+    elif last['id'] != current_id:
+        dummy, previous = history_state(series)
+        delta = dict(added=[], removed=[], modified=[])
+        diff_mappings(previous, mappings, [], delta)
+        series['entries'].append(dict(time=now, id=current_id, delta=delta))
+    series['last_seen'] = now
+
+    # Rebase the series on the last entry before the retention limit, which
+    # still gives the state at that limit
+    cutoff = now - module.params['history_retention'] * 86400
+    first = 0
+    while first + 1 < len(series['entries']) and series['entries'][first + 1]['time'] <= cutoff:
+        first += 1
+    if first:
+        entry, series['base'] = history_state(series, series['entries'][first]['time'])
+        series['entries'] = [dict(time=entry['time'], id=entry['id'])] + series['entries'][first + 1:]
+
+    save_store(module, history_path, history, compressed=True)
+    return current_id
+
+
+def parse_time(module, option):
+    """
+    Return the timestamp given by an option, as seconds since the Epoch or
+    as a local date and time in ISO 8601 format.
+    """
+    value = module.params[option]
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, time_format))
+        except ValueError:
+            continue
+    results['msg'] = f'Invalid {option} value: {value}, expecting seconds since the Epoch or YYYY-MM-DD[THH:MM[:SS]]'
+    module.fail_json(**results)
+
+
+def query_history(module):
+    """
+    Return the mappings at the time given by history_at, or the changes
+    between history_from and history_to, from the history store.
+    """
+    series = load_store(module, module.params['history_file'], compressed=True).get(cache_key(module))
+    if not series or not series['entries']:
+        results['msg'] = f'No mapping history for these options in {module.params["history_file"]}'
+        module.fail_json(**results)
+
+    if module.params['history_at']:
+        timestamp = parse_time(module, 'history_at')
+        entry, mappings = history_state(series, timestamp)
+        if entry is None:
+            results['msg'] = f'No mapping history at {module.params["history_at"]}, the history starts at {series["entries"][0]["time"]}'
+            module.fail_json(**results)
+        if module.params['format'] == 'columnar':
+            mappings = to_columnar(mappings)
+        return dict(time=entry['time'], snapshot_id=entry['id'], mappings=mappings)
+
+    start = parse_time(module, 'history_from')
+    end = parse_time(module, 'history_to') if module.params['history_to'] else time.time()
+    if end < start:
+        results['msg'] = f'history_to {module.params["history_to"]} is before history_from {module.params["history_from"]}'
+        module.fail_json(**results)
+    from_entry, from_mappings = history_state(series, start)
+    if from_entry is None:
+        results['msg'] = f'No mapping history at {module.params["history_from"]}, the history starts at {series["entries"][0]["time"]}'
+        module.fail_json(**results)
+    to_entry, to_mappings = history_state(series, end)
+    if to_entry is None:
+        results['msg'] = f'No mapping history at {module.params["history_to"]}, the history starts at {series["entries"][0]["time"]}'
+        module.fail_json(**results)
+    delta = dict(added=[], removed=[], modified=[])
+    diff_mappings(from_mappings, to_mappings, [], delta)
+    return dict(from_time=from_entry['time'], from_snapshot_id=from_entry['id'],
+                to_time=to_entry['time'], to_snapshot_id=to_entry['id'],
+                changes=[entry['time'] for entry in series['entries'] if start < entry['time'] <= end],
+                delta=delta)
+
+
+def flatten_record(record, row, prefix=''):
+    """
+    Add the attributes of a record to a row, nested dicts other than the
+    virtual target devices are flattened into dotted column names.
+    """
+    for key, value in record.items():
+        if key == 'vtds':
+            continue
+        if isinstance(value, dict):
+            flatten_record(value, row, f'{prefix}{key}.')
+        else:
+            row[prefix + key] = value
+
+
+def table_rows(adapters, keys, errors, path, parent=None):
+    """
+    Yield the rows of a component, one per virtual target device or one per
+    adapter if it has none, with the key columns of the record in front,
+    parent holds the key columns of the enclosing groups.
+    The errmsg entries of the cluster components are added to errors.
+    """
+    if len(keys) > 1:
+        for name, group in adapters.items():
+            if not isinstance(group, dict):
+                errors.append(dict(path=path + [name], errmsg=group))
+                continue
+            yield from table_rows(group, keys[1:], errors, path + [name], dict(parent or {}, **{keys[0]: name}))
+        return
+    for name, adapter in adapters.items():
+        if not isinstance(adapter, dict):
+            errors.append(dict(path=path + [name], errmsg=adapter))
+            continue
+        row = dict(parent or {}, **{keys[0]: name})
+        flatten_record(adapter, row)
+        if 'vtds' not in adapter:
+            yield row
+            continue
+        if not adapter['vtds']:
+            yield dict(row, vtd=None)
+        for vtd, record in adapter['vtds'].items():
+            vtd_row = dict(row, vtd=vtd)
+            flatten_record(record, vtd_row)
+            yield vtd_row
+
+
+def to_columnar(mappings):
+    """
+    Convert the mappings to the columnar format: each component becomes a
+    table of parallel column arrays, one row per virtual target device or
+    per adapter. The columns of interned_columns are interned, their values
+    are indexes into the strings list of the table.
+    """
+    tables = {}
+    for component, adapters in mappings.items():
+        errors = []
+        rows = list(table_rows(adapters, table_keys.get(component, ['adapter']), errors, [component]))
+        names = {}
+        for row in rows:
+            for name in row:
+                names.setdefault(name, len(names))
+        columns = dict((name, [row.get(name) for row in rows]) for name in sorted(names, key=names.get))
+
+        strings = []
+        interned = []
+        index = {}
+        for name, column in columns.items():
+            if name not in interned_columns:
+                continue
+            for i, value in enumerate(column):
+                if value is not None:
+                    if value not in index:
+                        index[value] = len(strings)
+                        strings.append(value)
+                    column[i] = index[value]
+            interned.append(name)
+
+        tables[component] = dict(rows=len(rows), columns=columns, interned=interned, strings=strings)
+        if errors:
+            tables[component]['errors'] = errors
+    return tables
+
+
+def iter_records(mappings):
+    """
+    Iterate over the adapters and virtual target devices of the mappings.
+    Yield tuples (path, record, adapter) where path is the list of keys of
+    the record into the mappings and adapter is the record of the server
+    adapter it belongs to.
+    """
+    for component, adapters in mappings.items():
+        if component == 'cluster':
+            groups = [([component, clustername], physmap) for clustername, physmap in adapters.items()]
+        elif component == 'cluster_nodes':
+            groups = [([component, clustername, node], physmap)
+                      for clustername, nodes in adapters.items() if isinstance(nodes, dict)
+                      for node, physmap in nodes.items() if isinstance(physmap, dict)]
+        else:
+            groups = [([component], adapters)]
+        for path, group in groups:
+            for name, adapter in group.items():
+                if not isinstance(adapter, dict):
+                    continue  # cluster errmsg
+                adapter_path = path + [name]
+                yield adapter_path, adapter, adapter
+                for vtd, record in adapter.get('vtds', {}).items():
+                    yield adapter_path + ['vtds', vtd], record, adapter
+
+
+def build_indexes(mappings, indexes):
+    """
+    Build the requested reverse lookup tables of the mappings.
+    """
+    tables = dict((index, {}) for index in indexes)
+
+    def add(index, key, path):
+        if index in tables and key not in (None, ''):
+            tables[index].setdefault(str(key), []).append(path)
+
+    for path, record, adapter in iter_records(mappings):
+        if record is adapter:
+            clientid = adapter.get('clientid', adapter.get('clntid'))
+            if clientid:
+                # 0 is not a partition but an unassigned or inactive adapter
+                add('client', clientid, path)
+            add('fc', record.get('fc'), path)
+            add('physloc', record.get('fcphysloc'), path)
+            if path[0] in ('cluster', 'cluster_nodes'):
+                add('physloc', path[-1], path)  # keyed by physloc
+            else:
+                add('physloc', record.get('physloc'), path)
+        add('backing', record.get('backing'), path)
+        add('physloc', record.get('bdphysloc'), path)
+
+    return tables
+
+
+def cluster_backings(mappings):
+    """
+    Return the set of logical unit backing names of the cluster mappings,
+    or None if they were not gathered or could not be retrieved.
+    """
+    backings = None
+    for component in ('cluster', 'cluster_nodes'):
+        if component not in mappings:
+            continue
+        if component == 'cluster':
+            groups = list(mappings[component].values())
+        else:
+            groups = [node for cluster in mappings[component].values() for node in cluster.values()]
+        # A cluster or node that could not be retrieved is replaced by an
+        # errmsg string, or by a dict holding one
+        if any(not isinstance(group, dict) or 'errmsg' in group for group in groups):
+            continue
+        backings = backings or set()
+        for group in groups:
+            for adapter in group.values():
+                backings.update(vtd.get('backing') for vtd in adapter.get('vtds', {}).values())
+    return backings
+
+
+def consistency_mappings(module, mappings):
+    """
+    Return the vscsi and npiv mappings to check, retrieving all of them
+    without projection if the gathered mappings are restricted.
+    """
+    selected = selected_components(module)
+    if not (module.params['fields'] or module.params['vadapter'] or module.params['physloc']
+            or module.params['cpid'] or module.params['types']
+            or 'vscsi' not in selected or 'npiv' not in selected):
+        return mappings
+
+    lsmaps = dict(
+        vscsi=([ioscli_cmd, 'lsmap', '-all', '-fmt', delimiter], parse_vscsi, 9, (10, 15)),
+        npiv=([ioscli_cmd, 'lsmap', '-npiv', '-all', '-fmt', delimiter], parse_npiv, 12, (10, 63)),
+    )
+    full = {}
+    with ThreadPoolExecutor(max_workers=len(lsmaps)) as executor:
+        # The consistency key has no fields projection
+        futures = dict((executor.submit(run_lsmap, module, 'consistency', cmd, parse_record, min_fields), component)
+                       for component, (cmd, parse_record, min_fields, no_adapter) in lsmaps.items())
+        for future in as_completed(futures):
+            component = futures[future]
+            ret, records, stdout, stderr = future.result()
+            if ret != 0 and ret not in lsmaps[component][3]:
+                lsmap_failed(module, ret, stdout, stderr)
+            full[component] = records
+    return full
+
+
+def check_consistency(module, mappings):
+    """
+    Report the stale configuration found in the mappings compared to the
+    devices of the VIOS, using set operations so that the check is linear
+    in the number of devices.
+    """
+    lus = cluster_backings(mappings)
+    if module.params['hostname'] or 'backing' not in (module.params['fields'] or {}).get('cluster', ['backing']):
+        lus = None  # Not all the logical units of the VIOS are known
+    mappings = consistency_mappings(module, mappings)
+    queries = dict(
+        devices=[lsdev_cmd, '-C', '-F', 'name'],
+        free=[ioscli_cmd, 'lspv', '-free', '-field', 'name', '-fmt', delimiter],
+    )
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        futures = dict((executor.submit(module.run_command, cmd), query) for query, cmd in queries.items())
+        for future in as_completed(futures):
+            ret, stdout, stderr = future.result()
+            if ret != 0:
+                results['msg'] = f'{" ".join(queries[futures[future]])} failed rc={ret}'
+                results['stdout'] = stdout
+                results['stderr'] = stderr
+                module.fail_json(**results)
+            outputs[futures[future]] = stdout
+    devices = set(line.strip() for line in outputs['devices'].splitlines() if line.strip())
+    free_disks = set(line.split(delimiter)[0].strip() for line in outputs['free'].splitlines() if line.strip())
+
+    anomalies = dict(missing_backing=[], free_disks_reserve_policy=[], adapters_without_client=[], duplicate_backings={})
+    vtds_by_backing = {}
+    for component in ('vscsi', 'npiv'):
+        for name, adapter in mappings.get(component, {}).items():
+            if adapter.get('clientid', adapter.get('clntid')) == 0:
+                anomalies['adapters_without_client'].append([component, name])
+            for vtd, record in adapter.get('vtds', {}).items():
+                backing = record.get('backing')
+                # File backed devices are not in the device list
+                if not backing or backing.startswith('/'):
+                    continue
+                # Logical units are not in the device list either
+                if is_lu_backing(backing):
+                    if lus is not None and backing not in lus:
+                        anomalies['missing_backing'].append(dict(path=[component, name, 'vtds', vtd], backing=backing))
+                    continue
+                if backing in devices:
+                    vtds_by_backing.setdefault(backing, []).append([component, name, 'vtds', vtd])
+                else:
+                    anomalies['missing_backing'].append(dict(path=[component, name, 'vtds', vtd], backing=backing))
+
+    anomalies['duplicate_backings'] = dict((backing, paths) for backing, paths in vtds_by_backing.items()
+                                           if len(paths) > 1)
+
+    # lspv -free lists the disks neither in a volume group nor mapped, a reserve
+    # policy other than no_reserve reserves them when opened, blocking the
+    # other VIOS of the pair once they are mapped
+    free_disks -= set(vtds_by_backing)
+    if free_disks:
+        attributes = backing_attributes(module, free_disks)
+        anomalies['free_disks_reserve_policy'] = [dict(name=name, reserve_policy=attributes[name]['reserve_policy'])
+                                                  for name in sorted(free_disks)
+                                                  if attributes[name].get('reserve_policy', 'no_reserve') != 'no_reserve']
+    return anomalies
+
+
+class TopologyGraph(object):
+    """
+    Directed graph of the virtualization topology, with typed nodes
+    identified by type:name and adjacency sets in both directions.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+        self.adjacency = {}
+        self.reverse_adjacency = {}
+
+    def node(self, node_type, name, attributes=None):
+        """
+        Add a node if needed, merge its scalar attributes and return its id.
+        """
+        node_id = f'{node_type}:{name}'
+        if node_id not in self.nodes:
+            self.nodes[node_id] = dict(type=node_type, name=str(name), attributes={})
+            self.adjacency[node_id] = set()
+            self.reverse_adjacency[node_id] = set()
+        for key, value in (attributes or {}).items():
+            if not isinstance(value, dict):
+                self.nodes[node_id]['attributes'][key] = value
+        return node_id
+
+    def edge(self, source, target):
+        """
+        Add an edge between two node ids.
+        """
+        self.adjacency[source].add(target)
+        self.reverse_adjacency[target].add(source)
+
+    def to_dict(self):
+        """
+        Return the graph with sorted adjacency lists.
+        """
+        return dict(nodes=self.nodes,
+                    adjacency=dict((node, sorted(targets)) for node, targets in self.adjacency.items()),
+                    reverse_adjacency=dict((node, sorted(sources)) for node, sources in self.reverse_adjacency.items()))
+
+
+def port_location(physloc):
+    """
+    Return the location code of the physical port of a backing device, that
+    is its location code without the -W<wwpn>-L<lun> suffix.
+    """
+    return physloc.split('-W')[0]
+
+
+def add_backing(graph, source, record):
+    """
+    Link a node to its backing device and the backing device to its location.
+    """
+    if not record.get('backing'):
+        return
+    backing = graph.node('backing_device', record['backing'])
+    graph.edge(source, backing)
+    if record.get('bdphysloc'):
+        graph.edge(backing, graph.node('location', port_location(record['bdphysloc'])))
+
+
+def build_graph(mappings):
+    """
+    Build the virtualization topology graph of the mappings:
+    client -> server adapter -> VTD -> backing device -> location,
+    client -> vfchost -> FC port -> location and
+    server virtual Ethernet adapter -> SEA -> backing device -> location.
+    """
+    graph = TopologyGraph()
+    adapter_types = dict(vscsi='vscsi_adapter', npiv='npiv_adapter', net='net_adapter', vnic='vnic_adapter',
+                         ams='paging_device', suspend='suspend_adapter')
+
+    for path, record, adapter in iter_records(mappings):
+        component = path[0]
+        if record is adapter:
+            if component in ('cluster', 'cluster_nodes'):
+                # Keyed by physloc, client IDs of other frames are kept as attributes
+                adapter_id = graph.node('cluster_adapter', path[-1], record)
+            else:
+                adapter_id = graph.node(adapter_types[component], path[-1], record)
+                clientid = record.get('clientid', record.get('clntid'))
+                if clientid:
+                    # 0 is not a partition but an unassigned or inactive adapter
+                    graph.edge(graph.node('client', clientid), adapter_id)
+            if record.get('fc'):
+                port = graph.node('fc_port', record['fc'])
+                graph.edge(adapter_id, port)
+                if record.get('fcphysloc'):
+                    graph.edge(port, graph.node('location', record['fcphysloc']))
+            if record.get('sea'):
+                sea = graph.node('sea', record['sea'])
+                graph.edge(adapter_id, sea)
+                add_backing(graph, sea, record)
+            elif 'vtds' not in record:
+                add_backing(graph, adapter_id, record)
+        else:
+            adapter_id = '{0}:{1}'.format(
+                'cluster_adapter' if component in ('cluster', 'cluster_nodes') else adapter_types[component],
+                path[-3])
+            if component in ('cluster', 'cluster_nodes'):
+                vtd = graph.node('vtd', f'{path[-3]}/{path[-1]}', record)
+            else:
+                vtd = graph.node('vtd', path[-1], record)
+            graph.edge(adapter_id, vtd)
+            add_backing(graph, vtd, record)
+
+    return graph.to_dict()
+
+
+def graph_to_graphml(graph):
+    """
+    Serialize the topology graph to GraphML.
+    """
+    root = ET.Element('graphml', xmlns='http://graphml.graphdrawing.org/xmlns')
+    for key in ('type', 'name', 'attributes'):
+        ET.SubElement(root, 'key', {'id': key, 'for': 'node', 'attr.name': key, 'attr.type': 'string'})
+    element = ET.SubElement(root, 'graph', id='mappings', edgedefault='directed')
+    for node_id in sorted(graph['nodes']):
+        node = graph['nodes'][node_id]
+        node_element = ET.SubElement(element, 'node', id=node_id)
+        ET.SubElement(node_element, 'data', key='type').text = node['type']
+        ET.SubElement(node_element, 'data', key='name').text = node['name']
+        ET.SubElement(node_element, 'data', key='attributes').text = json.dumps(node['attributes'], sort_keys=True)
+    for source in sorted(graph['adjacency']):
+        for target in graph['adjacency'][source]:
+            ET.SubElement(element, 'edge', source=source, target=target)
+    return ET.tostring(root, encoding='unicode')
+
+
+def write_graph(module, graph):
+    """
+    Write the topology graph to graph_file, return True if the file changed.
+    """
+    if module.params['graph_format'] == 'graphml':
+        content = graph_to_graphml(graph)
+    else:
+        content = json.dumps(graph, indent=2, sort_keys=True)
+
+    path = module.params['graph_file']
+    try:
+        with open(path, 'r') as graph_file:
+            if graph_file.read() == content:
+                return False
+    except (IOError, OSError):
+        pass
+    if module.check_mode:
+        return True
+    try:
+        with open(path, 'w') as graph_file:
+            graph_file.write(content)
+    except (IOError, OSError) as err:
+        results['msg'] = f'Could not write graph file {path}: {err}'
+        module.fail_json(**results)
+    return True
+
+
+def check_fields(module):
+    """
+    Check that the cpid option contains decimal client partition IDs and that
+    the fields option maps types of devices to lists of attributes.
+    """
+    for clientid in module.params['cpid'] or []:
+        if not clientid.isdigit():
+            results['msg'] = f'Invalid cpid value: {clientid}, expecting a decimal client partition ID'
+            module.fail_json(**results)
+
+    for component, names in (module.params['fields'] or {}).items():
+        if component not in components or not isinstance(names, list):
+            results['msg'] = f'Invalid fields value for {component}, expecting a list of attributes of a device type'
+            module.fail_json(**results)
+
+
+def selected_components(module):
+    """
+    Return the set of components to retrieve, from the gather_subset or the
+    component option.
+    """
+    gather_subset = module.params['gather_subset']
+    if not gather_subset:
+        if module.params['component'] == 'all':
+            return set(components)
+        return set([module.params['component']])
+
+    selected = set()
+    excluded = set()
+    for subset in gather_subset:
+        name = subset[1:] if subset.startswith('!') else subset
+        if name != 'all' and name not in components:
+            results['msg'] = f'Invalid gather_subset value: {subset}'
+            module.fail_json(**results)
+        names = set(components) if name == 'all' else set([name])
+        if subset.startswith('!'):
+            excluded |= names
+        else:
+            selected |= names
+    if not selected:
+        selected = set(components)
+    return selected - excluded
+
+
+def parse_odm(stdout):
+    """
+    Parse odmget output into a list of objects, as dicts of descriptor
+    name to value.
+    """
+    objects = []
+    current = None
     for line in stdout.splitlines():
-        raw_fields = line.split(delimiter)
-        if len(raw_fields) < 5:
+        if not line.strip():
+            current = None
+        elif line[0] not in ' \t':
+            current = {}
+            objects.append(current)
+        elif current is not None and '=' in line:
+            name, value = line.split('=', 1)
+            value = value.strip()
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1]
+            current[name.strip()] = value
+    return objects
+
+
+def backing_attributes(module, names):
+    """
+    Read the attributes of the backing devices in names with one query per
+    attribute, run concurrently, instead of one lsdev command per device.
+    Return a dict of device name to dict of attributes.
+    """
+    queries = dict(
+        lspv=[ioscli_cmd, 'lspv', '-size', '-field', 'name', 'pvid', 'size', '-fmt', delimiter],
+        unique_id=[odmget_cmd, '-q', 'attribute=unique_id', 'CuAt'],
+        reserve_policy=[odmget_cmd, '-q', 'attribute=reserve_policy', 'CuAt'],
+        # Default values of the attributes that were never changed are not in CuAt
+        default_policy=[odmget_cmd, '-q', 'attribute=reserve_policy', 'PdAt'],
+        types=[lsdev_cmd, '-C', '-F', 'name:PdDvLn'],
+    )
+    outputs = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(module.params['workers'], len(queries)))) as executor:
+        futures = dict((executor.submit(module.run_command, cmd), query) for query, cmd in queries.items())
+        for future in as_completed(futures):
+            ret, stdout, stderr = future.result()
+            query = futures[future]
+            if ret != 0:
+                module.warn(f'Could not read backing device attributes, {" ".join(queries[query])} failed rc={ret}: {stderr}')
+                stdout = ''
+            outputs[query] = stdout
+
+    attributes = dict((name, {}) for name in names)
+    for line in outputs['lspv'].splitlines():
+        fields = [field.strip() for field in line.split(delimiter)]
+        if len(fields) < 3 or fields[0] not in attributes:
             continue
-        fields = [field.strip() for field in raw_fields]
+        if fields[1] and fields[1] != 'none':
+            attributes[fields[0]]['pvid'] = fields[1]
+        if fields[2].isdigit():
+            attributes[fields[0]]['size'] = int(fields[2])
+
+    for attribute in ('unique_id', 'reserve_policy'):
+        for odm_object in parse_odm(outputs[attribute]):
+            if odm_object.get('name') in attributes:
+                attributes[odm_object['name']][attribute] = odm_object.get('value', '')
+
+    defaults = dict((odm_object.get('uniquetype'), odm_object.get('deflt'))
+                    for odm_object in parse_odm(outputs['default_policy']))
+    for line in outputs['types'].splitlines():
+        name, dummy, uniquetype = line.partition(':')
+        if name in attributes and 'reserve_policy' not in attributes[name] and uniquetype.strip() in defaults:
+            attributes[name]['reserve_policy'] = defaults[uniquetype.strip()]
+    return attributes
+
+
+def enrich_backing(module, mappings):
+    """
+    Attach the attributes of the backing device to each virtual target device.
+    """
+    vtds = [vtd for component in ('vscsi', 'suspend') for adapter in mappings.get(component, {}).values()
+            for vtd in adapter.get('vtds', {}).values() if 'backing' in vtd]
+    if not vtds:
+        return
+    attributes = backing_attributes(module, set(vtd['backing'] for vtd in vtds))
+    for vtd in vtds:
+        vtd['attributes'] = attributes[vtd['backing']]
 
-        physloc = fields[0]
-        if physloc not in physmap:
-            physmap[physloc] = {}
-            physmap[physloc]['vtds'] = {}
-            if fields[1] != 'suspended':
-                # Do the hexadecimal conversion ourselves as not all VIOS levels
-                # support lsmap -dec option.
-                physmap[physloc]['clientid'] = int(fields[1], 16)
 
-        if fields[2]:
-            vtd = fields[2]
-            physmap[physloc]['vtds'][vtd] = {}
-            physmap[physloc]['vtds'][vtd]['lun'] = fields[3]
-            physmap[physloc]['vtds'][vtd]['backing'] = fields[4]
+def fc_port_wwpn(module, port):
+    """
+    Return the worldwide port name of a physical fibre channel port, read
+    from its vital product data, or None.
+    """
+    ret, stdout, stderr = module.run_command([ioscli_cmd, 'lsdev', '-dev', port, '-vpd'])
+    if ret != 0:
+        module.warn(f'Could not read the WWPN of {port}, lsdev failed rc={ret}: {stderr}')
+        return None
+    for line in stdout.splitlines():
+        if line.strip().startswith('Network Address'):
+            return line.split('.')[-1].strip() or None
+    return None
+
+
+def enrich_npiv(module, mappings):
+    """
+    Attach the information of the physical fibre channel port to each NPIV
+    mapping. lsnports and the WWPN query of each port are run concurrently,
+    once per port rather than once per adapter.
+    """
+    adapters = [adapter for adapter in mappings.get('npiv', {}).values() if adapter.get('fc')]
+    ports = set(adapter['fc'] for adapter in adapters)
+    if not ports:
+        return
+
+    cmd = [ioscli_cmd, 'lsnports', '-fmt', delimiter]
+    with ThreadPoolExecutor(max_workers=max(1, min(module.params['workers'], len(ports) + 1))) as executor:
+        lsnports = executor.submit(module.run_command, cmd)
+        futures = dict((executor.submit(fc_port_wwpn, module, port), port) for port in ports)
+        wwpns = dict((futures[future], future.result()) for future in as_completed(futures))
+        ret, stdout, stderr = lsnports.result()
+
+    fcports = dict((port, {}) for port in ports)
+    if ret != 0:
+        module.warn(f'Could not read the NPIV ports, lsnports failed rc={ret}: {stderr}')
+    else:
+        # List of fields returned by lsnports:
+        # name:physloc:fabric:tports:aports:swwpns:awwpns
+        for line in stdout.splitlines():
+            fields = [field.strip() for field in line.split(delimiter)]
+            if len(fields) < 7 or fields[0] not in fcports:
+                continue
+            try:
+                fcports[fields[0]].update(physloc=fields[1], fabric=fields[2] == '1', tports=int(fields[3]),
+                                          aports=int(fields[4]), swwpns=int(fields[5]), awwpns=int(fields[6]))
+            except ValueError:
+                continue
+    for port, wwpn in wwpns.items():
+        if wwpn:
+            fcports[port]['wwpn'] = wwpn
+
+    for adapter in adapters:
+        adapter['fcport'] = fcports[adapter['fc']]
+
+
+def gather_mappings(module):
+    """
+    Gather the mappings for the requested components.
+    """
+    mappings = {}
+    collectors = []
 
-    mappings['cluster'][clustername] = physmap
+    # Populate mappings
+    selected = selected_components(module)
+    if 'vscsi' in selected:
+        collectors.append((lsmap_vscsi, vscsi_mappings))
+    if 'ams' in selected:
+        collectors.append((lsmap_ams, ams_mappings))
+    if 'suspend' in selected:
+        collectors.append((lsmap_suspend, suspend_mappings))
+    if not module.params['types']:
+        if 'npiv' in selected:
+            collectors.append((lsmap_npiv, npiv_mappings))
+        if 'net' in selected:
+            collectors.append((lsmap_net, net_mappings))
+        if 'vnic' in selected:
+            collectors.append((lsmap_vnic, vnic_mappings))
+        if 'cluster' in selected and module.params['cluster_nodes']:
+            collectors.append((lsmap_cluster_nodes, cluster_nodes_mappings))
+        elif 'cluster' in selected:
+            collectors.append((lsmap_cluster, cluster_mappings))
+    collect_mappings(module, collectors, mappings)
+
+    if 'backing' in (module.params['enrich'] or []):
+        enrich_backing(module, mappings)
+    if 'npiv' in (module.params['enrich'] or []):
+        enrich_npiv(module, mappings)
+
+    return mappings
 
 
 def main():
@@ -974,40 +2605,84 @@ def main():
                            choices=['vscsi', 'net', 'npiv', 'vnic',
                                     'ams', 'suspend', 'cluster', 'all'],
                            default='all'),
-            vadapter=dict(type='str'),
-            physloc=dict(type='str'),
+            gather_subset=dict(type='list', elements='str'),
+            fields=dict(type='dict'),
+            vadapter=dict(type='list', elements='str'),
+            physloc=dict(type='list', elements='str'),
             vtd=dict(type='str'),
             hostname=dict(type='str'),
-            cpid=dict(type='str'),
-            types=dict(type='list', elements='str')
+            cluster_nodes=dict(type='bool', default=False),
+            cpid=dict(type='list', elements='str'),
+            types=dict(type='list', elements='str'),
+            workers=dict(type='int', default=4),
+            cache=dict(type='bool', default=False),
+            cache_file=dict(type='path', default='/var/adm/ansible/mapping_facts_cache.json'),
+            max_age=dict(type='int', default=300),
+            delta=dict(type='bool', default=False),
+            since=dict(type='str'),
+            snapshot_file=dict(type='path', default='/var/adm/ansible/mapping_facts_snapshot.json'),
+            indexes=dict(type='list', elements='str',
+                         choices=['backing', 'client', 'physloc', 'fc']),
+            graph=dict(type='bool', default=False),
+            graph_file=dict(type='path'),
+            graph_format=dict(type='str', choices=['json', 'graphml'], default='json'),
+            enrich=dict(type='list', elements='str', choices=['backing', 'npiv']),
+            consistency=dict(type='bool', default=False),
+            format=dict(type='str', choices=['nested', 'columnar'], default='nested'),
+            stats=dict(type='bool', default=False),
+            history=dict(type='bool', default=False),
+            history_file=dict(type='path', default='/var/adm/ansible/mapping_facts_history.json.gz'),
+            history_retention=dict(type='int', default=30),
+            history_at=dict(type='str'),
+            history_from=dict(type='str'),
+            history_to=dict(type='str')
         ),
         mutually_exclusive=[
             ['vadapter', 'physloc'],
+            ['history_at', 'history_from'],
         ],
+        required_by=dict(history_to='history_from'),
         supports_check_mode=True
     )
 
-    mappings = {}
+    check_fields(module)
 
-    # Populate mappings
-    component = module.params['component']
-    if component == 'all' or component == 'vscsi':
-        vscsi_mappings(module, mappings)
-    if component == 'all' or component == 'ams':
-        ams_mappings(module, mappings)
-    if component == 'all' or component == 'suspend':
-        suspend_mappings(module, mappings)
-    if not module.params['types']:
-        if component == 'all' or component == 'npiv':
-            npiv_mappings(module, mappings)
-        if component == 'all' or component == 'net':
-            net_mappings(module, mappings)
-        if component == 'all' or component == 'vnic':
-            vnic_mappings(module, mappings)
-        if component == 'all' or component == 'cluster':
-            cluster_mappings(module, mappings)
+    if module.params['history_at'] or module.params['history_from']:
+        module.exit_json(changed=False, history=query_history(module))
+
+    mappings = None
+    cache_hit = False
+    if module.params['cache']:
+        fingerprint = device_fingerprint(module)
+        mappings = cached_mappings(module, fingerprint)
+        cache_hit = mappings is not None
+
+    if mappings is None:
+        mappings = gather_mappings(module)
+        if module.params['cache']:
+            save_cache(module, fingerprint, mappings)
 
     results = dict(ansible_facts=dict(mappings=mappings))
+    if module.params['indexes']:
+        results['ansible_facts']['mapping_indexes'] = build_indexes(mappings, module.params['indexes'])
+    if module.params['graph'] or module.params['graph_file']:
+        graph = build_graph(mappings)
+        if module.params['graph']:
+            results['ansible_facts']['mapping_graph'] = graph
+        if module.params['graph_file']:
+            results['changed'] = write_graph(module, graph)
+    if module.params['cache']:
+        results['cache_hit'] = cache_hit
+    if module.params['consistency']:
+        results['anomalies'] = check_consistency(module, mappings)
+    if module.params['stats']:
+        results['stats'] = stats
+    if module.params['history']:
+        results['snapshot_id'] = record_history(module, mappings)
+    if module.params['format'] == 'columnar':
+        results['ansible_facts']['mappings'] = to_columnar(mappings)
+    if module.params['delta']:
+        delta_mappings(module, mappings, results)
 
     module.exit_json(**results)
 
@@ -0,0 +1,299 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+author:
+- AIX Development Team (@pbfinley1911)
+module: mapping_iostat
+short_description: Returns the I/O statistics of the client partitions and virtual target devices
+description:
+- Samples the extended statistics of all the disks of the VIOS over an interval with a single
+  iostat command and joins them with the virtual SCSI mappings, to attribute the I/O load of the
+  backing disks to virtual target devices and client partitions.
+- The I/O of NPIV clients does not go through the disks of the VIOS, their NPIV adapters and
+  physical fibre channel ports are listed without statistics.
+version_added: '2.9'
+requirements:
+- VIOS >= 2.2.5.0
+- Python >= 2.7
+options:
+  interval:
+    description:
+    - Specifies the sampling interval in seconds.
+    type: int
+    default: 5
+  cpid:
+    description:
+    - Specifies the client partition IDs to return the statistics of, in decimal.
+    - If not set, all the client partitions are returned.
+    type: list
+    elements: str
+  mappings:
+    description:
+    - Specifies the I(mappings) facts returned by M(ibm.power_vios.mapping_facts), in the
+      C(nested) format, to join the statistics with.
+    - If not set, the C(vscsi) and C(npiv) mappings are retrieved with lsmap.
+    type: dict
+notes:
+- Only the virtual target devices backed by a disk have statistics, logical volume,
+  file and logical unit backing devices are not sampled.
+- Adapters shared between client partitions are not an issue, but a disk also used by the
+  VIOS itself has its whole load attributed to the virtual target device.
+'''
+
+EXAMPLES = r'''
+- name: Sample the I/O statistics of client partition 7 over 10 seconds
+  mapping_iostat:
+    cpid: 7
+    interval: 10
+  register: result
+- debug:
+    var: result.clients['7']
+
+- name: Reuse the mapping facts gathered earlier
+  mapping_iostat:
+    mappings: "{{ ansible_facts.mappings }}"
+'''
+
+RETURN = r'''
+clients:
+  description:
+  - I/O statistics of each client partition, keyed by client partition ID, summed over
+    its virtual target devices.
+  - I(tps), I(rps) and I(wps) are the transfers, reads and writes per second, I(bps),
+    I(read_bps) and I(write_bps) the bytes per second, I(read_serv) and I(write_serv)
+    the average read and write service times in milliseconds, weighted by the number
+    of operations.
+  - I(vtds) lists the paths of the virtual target devices of the client, as lists of
+    keys into I(vtds), and I(npiv) its NPIV adapters and physical ports.
+  - The adapters not assigned to a client partition, whose client partition ID is 0, are
+    grouped under the C(unassigned) key.
+  returned: always
+  type: dict
+  sample:
+    "clients": {
+        "24": {
+            "bps": 1048576.0,
+            "read_bps": 786432.0,
+            "write_bps": 262144.0,
+            "tps": 120.0,
+            "rps": 90.0,
+            "wps": 30.0,
+            "read_serv": 1.2,
+            "write_serv": 0.8,
+            "vtds": [["vhost0", "vtscsi0"]],
+            "npiv": [{"adapter": "vfchost18", "fc": "fcs1"}]
+        }
+    }
+vtds:
+  description:
+  - I/O statistics of each virtual target device backed by a disk, keyed by server
+    adapter name and virtual target device name, in the same units as I(clients).
+  returned: always
+  type: dict
+  sample:
+    "vtds": {
+        "vhost0": {
+            "vtscsi0": {
+                "backing": "hdisk4",
+                "clientid": 24,
+                "bps": 1048576.0,
+                "read_bps": 786432.0,
+                "write_bps": 262144.0,
+                "tps": 120.0,
+                "rps": 90.0,
+                "wps": 30.0,
+                "read_serv": 1.2,
+                "write_serv": 0.8
+            }
+        }
+    }
+cmd:
+  description: The last command.
+  returned: If the command was run.
+  type: str
+msg:
+  description: The execution message.
+  returned: always
+  type: str
+stdout:
+  description: The standard output of the failed command.
+  returned: If the command failed.
+  type: str
+stderr:
+  description: The standard error of the failed command.
+  returned: If the command failed.
+  type: str
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import (
+    delimiter, parse_vscsi, parse_npiv, parse_output, command_failed,
+)
+
+
+ioscli_cmd = '/usr/ios/cli/ioscli'
+iostat_cmd = '/usr/bin/iostat'
+# Multipliers of the iostat value suffixes
+suffixes = dict(K=1024.0, M=1024.0 ** 2, G=1024.0 ** 3, T=1024.0 ** 4, S=1000.0)
+# Columns of iostat -Dl disk lines used
+iostat_columns = dict(bps=2, tps=3, read_bps=4, write_bps=5, rps=6, read_serv=7, wps=12, write_serv=13)
+results = dict(
+    changed=False,
+    cmd='',
+    msg='',
+    stdout='',
+    stderr='',
+)
+
+
+def parse_lsmap(module, cmd, output, parse_record, min_fields, no_adapter_rc):
+    """
+    Parse the output of an lsmap command and return the records.
+    """
+    ret, stdout, stderr = output
+    if ret != 0:
+        if ret in no_adapter_rc:
+            return {}
+        command_failed(module, results, cmd, ret, stdout, stderr)
+    return parse_output(stdout, parse_record, min_fields)
+
+
+def parse_value(value):
+    """
+    Convert an iostat value with an optional K, M, G, T or S suffix.
+    """
+    if value and value[-1] in suffixes:
+        return float(value[:-1]) * suffixes[value[-1]]
+    return float(value)
+
+
+def parse_iostat(module, cmd, output):
+    """
+    Parse the extended statistics of the disks sampled by iostat -D -l.
+    iostat reports the statistics since boot first, only the second report
+    is kept.
+    Return a dict of disk name to statistics.
+    """
+    ret, stdout, stderr = output
+    if ret != 0:
+        command_failed(module, results, cmd, ret, stdout, stderr)
+
+    disks = {}
+    for line in stdout.splitlines():
+        fields = line.split()
+        if len(fields) < 24:
+            continue
+        try:
+            # Later reports overwrite the earlier ones
+            disks[fields[0]] = dict((name, parse_value(fields[column])) for name, column in iostat_columns.items())
+        except ValueError:
+            continue  # header line
+    return disks
+
+
+def client_key(clientid):
+    """
+    Return the key of a client partition in the clients result, adapters that are not
+    assigned to a client partition have a client partition ID of 0.
+    """
+    return str(clientid) if clientid else 'unassigned'
+
+
+def add_stats(total, stats):
+    """
+    Add the statistics of a disk to a total, service times are weighted by
+    the number of operations.
+    """
+    for name in ('bps', 'read_bps', 'write_bps', 'tps', 'rps', 'wps'):
+        total[name] = total.get(name, 0.0) + stats[name]
+    total['read_time'] = total.get('read_time', 0.0) + stats['rps'] * stats['read_serv']
+    total['write_time'] = total.get('write_time', 0.0) + stats['wps'] * stats['write_serv']
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            interval=dict(type='int', default=5),
+            cpid=dict(type='list', elements='str'),
+            mappings=dict(type='dict'),
+        ),
+        supports_check_mode=True
+    )
+
+    for clientid in module.params['cpid'] or []:
+        if not clientid.isdigit():
+            results['msg'] = f'Invalid cpid value: {clientid}, expecting a decimal client partition ID'
+            module.fail_json(**results)
+    if module.params['interval'] < 1:
+        results['msg'] = 'interval must be at least 1 second'
+        module.fail_json(**results)
+    selected = set(int(clientid) for clientid in module.params['cpid'] or [])
+
+    # Sample the disks while the mappings are retrieved
+    commands = dict(iostat=[iostat_cmd, '-D', '-l', str(module.params['interval']), '2'])
+    if module.params['mappings'] is None:
+        commands['vscsi'] = [ioscli_cmd, 'lsmap', '-all', '-fmt', delimiter]
+        commands['npiv'] = [ioscli_cmd, 'lsmap', '-npiv', '-all', '-fmt', delimiter]
+    with ThreadPoolExecutor(max_workers=len(commands)) as executor:
+        futures = dict((name, executor.submit(module.run_command, cmd)) for name, cmd in commands.items())
+        outputs = dict((name, future.result()) for name, future in futures.items())
+
+    disks = parse_iostat(module, commands['iostat'], outputs['iostat'])
+    if module.params['mappings'] is not None:
+        vscsi = module.params['mappings'].get('vscsi', {})
+        npiv = module.params['mappings'].get('npiv', {})
+    else:
+        vscsi = parse_lsmap(module, commands['vscsi'], outputs['vscsi'], parse_vscsi, 9, (10, 15))
+        npiv = parse_lsmap(module, commands['npiv'], outputs['npiv'], parse_npiv, 12, (10, 63))
+
+    clients = {}
+    vtds = {}
+    for adapter, mapping in vscsi.items():
+        clientid = mapping.get('clientid')
+        if selected and clientid not in selected:
+            continue
+        for vtd, record in mapping.get('vtds', {}).items():
+            stats = disks.get(record.get('backing'))
+            if stats is None:
+                continue
+            vtds.setdefault(adapter, {})[vtd] = dict(stats, backing=record['backing'], clientid=clientid)
+            client = clients.setdefault(client_key(clientid), dict(vtds=[], npiv=[]))
+            client['vtds'].append([adapter, vtd])
+            add_stats(client, stats)
+    for adapter, mapping in npiv.items():
+        clientid = mapping.get('clntid')
+        if selected and clientid not in selected:
+            continue
+        client = clients.setdefault(client_key(clientid), dict(vtds=[], npiv=[]))
+        client['npiv'].append(dict(adapter=adapter, fc=mapping.get('fc')))
+
+    for client in clients.values():
+        if 'rps' not in client:
+            continue  # NPIV only
+        read_time = client.pop('read_time')
+        write_time = client.pop('write_time')
+        client['read_serv'] = round(read_time / client['rps'], 3) if client['rps'] else 0.0
+        client['write_serv'] = round(write_time / client['wps'], 3) if client['wps'] else 0.0
+
+    results['clients'] = clients
+    results['vtds'] = vtds
+    results['msg'] = f'{len(disks)} disks sampled over {module.params["interval"]} seconds'
+    module.exit_json(**results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+author:
+- AIX Development Team (@pbfinley1911)
+module: mapping_query
+short_description: Returns the mappings matching a query
+description:
+- Returns the mappings between the virtual host adapters and the physical devices that
+  match a query on the backing device, client partition, physical location code, virtual
+  target device or logical unit number, without returning all the mappings of the VIOS.
+- Only the lsmap commands that can answer the query are run. The client partition ID and
+  physical location code are passed to lsmap, the other criteria are applied to the lsmap
+  output as it is produced, so only the matching mappings are kept in memory.
+- All the criteria given must match.
+version_added: '2.9'
+requirements:
+- VIOS >= 2.2.5.0
+- Python >= 2.7
+options:
+  component:
+    description:
+    - Specifies the type of mappings to query.
+    - C(vscsi) for virtual SCSI mappings.
+    - C(npiv) for NPIV mappings.
+    - C(net) for shared Ethernet adapter mappings.
+    - C(vnic) for virtual NIC mappings.
+    - C(cluster) for the shared storage pool mappings of all the nodes of the cluster.
+    - If not set, the types of mappings that can match the query are queried, C(vscsi)
+      for I(backing), I(vtd) and I(lun), C(vscsi), C(npiv) and C(vnic) for I(cpid) and
+      C(vscsi), C(npiv), C(net) and C(vnic) for I(physloc).
+    type: str
+    choices: [vscsi, npiv, net, vnic, cluster]
+  backing:
+    description:
+    - Specifies the backing device name, such as an hdisk, a logical volume, a file or a
+      shared storage pool logical unit.
+    type: str
+  cpid:
+    description:
+    - Specifies the client partition ID, in decimal.
+    type: str
+  physloc:
+    description:
+    - Specifies the physical location code of the server virtual adapter.
+    type: str
+  vtd:
+    description:
+    - Specifies the virtual target device name.
+    type: str
+  lun:
+    description:
+    - Specifies the logical unit number, as displayed by lsmap, for instance
+      C(0x8100000000000000).
+    type: str
+notes:
+- Use M(ibm.power_vios.mapping_facts) to retrieve all the mappings of the VIOS.
+'''
+
+EXAMPLES = r'''
+- name: Find the virtual target device mapping the logical unit LU42
+  mapping_query:
+    backing: LU42.b1277fffdd5f38acb365413b55e51638
+  register: result
+- debug:
+    var: result.mappings[0].vtd
+
+- name: Find what is mapped to client partition 7
+  mapping_query:
+    cpid: 7
+  register: result
+
+- name: Find the shared storage pool mapping of a LUN on all the nodes of the cluster
+  mapping_query:
+    component: cluster
+    lun: "0x8200000000000000"
+'''
+
+RETURN = r'''
+mappings:
+  description:
+  - Matching mappings, one per virtual target device, or per adapter for the types
+    of mappings without virtual target devices.
+  - I(component) is the type of the mapping and I(adapter) the server virtual adapter,
+    or I(cluster) and I(physloc) for the C(cluster) mappings. The other attributes are
+    those of the adapter and of the virtual target device as returned in the I(mappings)
+    facts of M(ibm.power_vios.mapping_facts).
+  returned: always
+  type: list
+  elements: dict
+  sample:
+    "mappings": [
+        {
+            "adapter": "vhost0",
+            "backing": "hdisk4",
+            "bdphysloc": "U78CD.001.FZH1998-P1-C6-T2-W500507680B215660-L0",
+            "clientid": 24,
+            "component": "vscsi",
+            "lun": "0x8100000000000000",
+            "mirrored": false,
+            "physloc": "U8284.22A.21FD4BV-V1-C29",
+            "status": "Available",
+            "vtd": "vtscsi0"
+        }
+    ]
+cmd:
+  description: The last command.
+  returned: If the command was run.
+  type: str
+msg:
+  description: The execution message.
+  returned: always
+  type: str
+stdout:
+  description: The standard output of the failed command.
+  returned: If the command failed.
+  type: str
+stderr:
+  description: The standard error of the failed command.
+  returned: If the command failed.
+  type: str
+'''
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import (
+    delimiter, parse_vscsi, parse_npiv, parse_net, parse_vnic, parse_cluster, split_record, stream_lsmap,
+)
+
+
+ioscli_cmd = '/usr/ios/cli/ioscli'
+# Types of mappings that can answer each criterion
+query_components = dict(
+    backing=['vscsi'],
+    vtd=['vscsi'],
+    lun=['vscsi'],
+    cpid=['vscsi', 'npiv', 'vnic'],
+    physloc=['vscsi', 'npiv', 'net', 'vnic'],
+)
+# lsmap return codes when there is no adapter of the type of mappings
+no_adapter_rc = dict(vscsi=(10, 15), npiv=(10, 63), net=(10, 16), vnic=(10, 88))
+results = dict(
+    changed=False,
+    cmd='',
+    msg='',
+    stdout='',
+    stderr='',
+)
+
+
+# Options and parser of the lsmap command of each type of mappings
+lsmap_variants = dict(
+    vscsi=([], parse_vscsi, 9),
+    npiv=(['-npiv'], parse_npiv, 12),
+    net=(['-net'], parse_net, 6),
+    vnic=(['-vnic'], parse_vnic, 10),
+)
+
+
+def record_rows(component, name, record, key='adapter'):
+    """
+    Yield the flat rows of a parsed record, one per virtual target device or
+    one for the adapter if it has none.
+    """
+    row = dict(component=component)
+    row[key] = name
+    row.update((attr, value) for attr, value in record.items() if attr != 'vtds')
+    if not record.get('vtds'):
+        yield row
+        return
+    for vtd, attrs in record['vtds'].items():
+        vtd_row = dict(row, vtd=vtd)
+        vtd_row.update(attrs)
+        yield vtd_row
+
+
+def is_match(module, row):
+    """
+    Check if a row matches all the criteria of the query.
+    """
+    params = module.params
+    if params['backing'] is not None and row.get('backing') != params['backing']:
+        return False
+    if params['vtd'] is not None and row.get('vtd') != params['vtd']:
+        return False
+    if params['lun'] is not None and row.get('lun', '').lower() != params['lun'].lower():
+        return False
+    if params['cpid'] is not None and row.get('clientid', row.get('clntid')) != int(params['cpid']):
+        return False
+    if params['physloc'] is not None and row.get('physloc') != params['physloc']:
+        return False
+    return True
+
+
+def run_lsmap(module, component, cmd, parse_record, min_fields, key='adapter', group=None):
+    """
+    Run an lsmap command and keep the rows of its output that match the
+    query, one record at a time, as the command produces it.
+    group, if set, is added to the rows under the cluster key.
+    Return a tuple (rc, rows, stdout, stderr).
+    """
+    rows = []
+
+    def parse_line(line):
+        fields = split_record(line, min_fields)
+        if fields is None:
+            return False
+        records = {}
+        try:
+            parse_record(fields, records)
+        except (ValueError, IndexError):
+            return False
+        for name, record in records.items():
+            for row in record_rows(component, name, record, key):
+                if group is not None:
+                    row['cluster'] = group
+                if is_match(module, row):
+                    rows.append(row)
+        return True
+
+    ret, stdout, stderr = stream_lsmap(module, cmd, parse_line)
+    return ret, rows, stdout, stderr
+
+
+def lsmap_cmd(module, component):
+    """
+    Build the lsmap command of a type of mappings, with the client partition
+    and physical location code of the query as lsmap options.
+    """
+    cmd = [ioscli_cmd, 'lsmap'] + lsmap_variants[component][0]
+    if module.params['physloc']:
+        cmd += ['-plc', module.params['physloc']]
+    else:
+        cmd += ['-all']
+    if module.params['cpid'] and component != 'net':
+        cmd += ['-cpid', module.params['cpid']]
+    cmd += ['-fmt', delimiter]
+    return cmd
+
+
+def query_adapters(module, component):
+    """
+    Query a type of mappings.
+    Return a tuple (cmd, rc, rows, stdout, stderr), rc is 0 if the error
+    only means that the VIOS has no adapter of this type.
+    """
+    cmd = lsmap_cmd(module, component)
+    dummy, parse_record, min_fields = lsmap_variants[component]
+    ret, rows, stdout, stderr = run_lsmap(module, component, cmd, parse_record, min_fields)
+    if ret != 0:
+        if module.params['component'] is None and ret in no_adapter_rc[component]:
+            ret = 0
+        elif component == 'vnic' and 'Option flag is not valid' in stderr:
+            ret = 0  # Ignore if lsmap -vnic option is not supported
+    return cmd, ret, rows, stdout, stderr
+
+
+def query_cluster(module):
+    """
+    Query the shared storage pool mappings.
+    Return a tuple (cmd, rc, rows, stdout, stderr).
+    """
+    cmd = [ioscli_cmd, 'cluster', '-list', '-field', 'cluster_name', '-fmt', ',']
+    ret, stdout, stderr = module.run_command(cmd)
+    if ret != 0 or not stdout.strip():
+        return cmd, 0, [], '', ''  # assume no cluster found
+    clustername = stdout.splitlines()[0]
+
+    cmd = [ioscli_cmd, 'lsmap', '-clustername', clustername, '-all', '-fmt', delimiter]
+    ret, rows, stdout, stderr = run_lsmap(module, 'cluster', cmd, parse_cluster, 5, key='physloc', group=clustername)
+    return cmd, ret, rows, stdout, stderr
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            component=dict(type='str', choices=['vscsi', 'npiv', 'net', 'vnic', 'cluster']),
+            backing=dict(type='str'),
+            cpid=dict(type='str'),
+            physloc=dict(type='str'),
+            vtd=dict(type='str'),
+            lun=dict(type='str'),
+        ),
+        required_one_of=[
+            ['backing', 'cpid', 'physloc', 'vtd', 'lun'],
+        ],
+        supports_check_mode=True
+    )
+
+    if module.params['cpid'] is not None and not module.params['cpid'].isdigit():
+        results['msg'] = f'Invalid cpid value: {module.params["cpid"]}, expecting a decimal client partition ID'
+        module.fail_json(**results)
+
+    if module.params['component']:
+        selected = [module.params['component']]
+    else:
+        # Only the types of mappings that can match all the criteria
+        selected = ['vscsi', 'npiv', 'net', 'vnic']
+        for criterion, criterion_components in query_components.items():
+            if module.params[criterion] is not None:
+                selected = [component for component in selected if component in criterion_components]
+
+    mappings = []
+    # The selected types of mappings are queried concurrently
+    with ThreadPoolExecutor(max_workers=max(1, len(selected))) as executor:
+        futures = []
+        for component in selected:
+            if component == 'cluster':
+                futures.append(executor.submit(query_cluster, module))
+            else:
+                futures.append(executor.submit(query_adapters, module, component))
+        for future in futures:
+            cmd, ret, rows, stdout, stderr = future.result()
+            results['cmd'] = ' '.join(cmd)
+            if ret != 0:
+                results['msg'] = f'lsmap failed rc={ret}'
+                results['stdout'] = stdout
+                results['stderr'] = stderr
+                module.fail_json(**results)
+            mappings += rows
+
+    results['mappings'] = mappings
+    results['msg'] = f'{len(mappings)} mapping(s) found'
+    module.exit_json(**results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,399 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2020- IBM, Inc
+# GNU General Public License v3.0+ (see COPYING or https://www.gnu.org/licenses/gpl-3.0.txt)
+
+from __future__ import absolute_import, division, print_function
+__metaclass__ = type
+
+ANSIBLE_METADATA = {'metadata_version': '1.1',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = r'''
+---
+author:
+- AIX Development Team (@pbfinley1911)
+module: sea_facts
+short_description: Returns the throughput and state of the shared Ethernet adapters as facts
+description:
+- Samples the entstat statistics of every shared Ethernet adapter (SEA) twice, all the SEAs
+  concurrently, and computes the packet, throughput and error rates of the SEA and of each of
+  its real, trunk and control adapters over the interval.
+- The entstat output is parsed as the command produces it, only the counters are kept.
+- Reports the high availability state of each SEA and the virtual Ethernet server adapters of
+  the C(net) mappings that it bridges.
+version_added: '2.9'
+requirements:
+- VIOS >= 2.2.5.0
+- Python >= 2.7
+options:
+  interval:
+    description:
+    - Specifies the time in seconds between the two samples.
+    type: int
+    default: 5
+  seas:
+    description:
+    - Specifies the shared Ethernet adapters to sample.
+    - If not set, all the shared Ethernet adapters of the C(net) mappings are sampled.
+    type: list
+    elements: str
+  mappings:
+    description:
+    - Specifies the I(mappings) facts returned by M(ibm.power_vios.mapping_facts), in the
+      C(nested) format, to join the statistics with.
+    - If not set, the C(net) mappings are retrieved with lsmap.
+    type: dict
+'''
+
+EXAMPLES = r'''
+- name: Sample the shared Ethernet adapters over 10 seconds
+  sea_facts:
+    interval: 10
+- name: Print the SEAs that are not primary
+  debug:
+    msg: "{{ ansible_facts.seas | dict2items | rejectattr('value.state', 'match', 'PRIMARY') | map(attribute='key') | list }}"
+'''
+
+RETURN = r'''
+ansible_facts:
+  description:
+  - Facts to add to ansible_facts about the shared Ethernet adapters.
+  returned: always
+  type: complex
+  contains:
+    seas:
+      description:
+      - Maps shared Ethernet adapter name to its state and load over the interval.
+      - I(state), I(ha_mode), I(bridge_mode) and I(priority) are the high availability state,
+        mode, bridge mode and priority of the SEA, when entstat reports them.
+      - I(mappings) are the virtual Ethernet server adapters of the C(net) mappings bridged by the SEA.
+      - I(adapters) maps the real, trunk and control adapters of the SEA to their I(role) and load.
+        Trunk adapters have their I(priority), I(active) state, I(pvid) and I(vlans), real adapters
+        their I(link_status), I(speed) in Mb/s and I(utilization) in percent of the speed.
+        An adapter that is not in the first sample, such as one added to the SEA during the
+        interval, is not reported as its rates are unknown.
+      - I(tx_mbps), I(rx_mbps) and I(mbps) are the transmitted, received and total megabytes per
+        second, I(tx_pps) and I(rx_pps) the packets per second.
+      - I(errors) has the error counters since the last reset and I(new_errors) their increase
+        over the interval.
+      returned: always
+      type: dict
+      sample:
+        "seas": {
+            "ent8": {
+                "state": "PRIMARY",
+                "ha_mode": "Auto",
+                "bridge_mode": "All",
+                "priority": 1,
+                "interval": 5.02,
+                "mappings": ["ent6"],
+                "tx_mbps": 12.3,
+                "rx_mbps": 40.1,
+                "mbps": 52.4,
+                "tx_pps": 10234.0,
+                "rx_pps": 31021.2,
+                "errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 12},
+                "new_errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 0},
+                "adapters": {
+                    "ent0": {
+                        "role": "real",
+                        "link_status": "Up",
+                        "speed": 10000,
+                        "utilization": 3.4,
+                        "tx_mbps": 40.1,
+                        "rx_mbps": 12.3,
+                        "mbps": 52.4,
+                        "tx_pps": 31021.2,
+                        "rx_pps": 10234.0,
+                        "errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 0},
+                        "new_errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 0}
+                    },
+                    "ent6": {
+                        "role": "virtual",
+                        "priority": 1,
+                        "active": true,
+                        "pvid": 99,
+                        "vlans": [10, 20, 30],
+                        "tx_mbps": 12.3,
+                        "rx_mbps": 40.1,
+                        "mbps": 52.4,
+                        "tx_pps": 10234.0,
+                        "rx_pps": 31021.2,
+                        "errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 12},
+                        "new_errors": {"tx_errors": 0, "rx_errors": 0, "tx_dropped": 0, "rx_dropped": 0}
+                    }
+                }
+            }
+        }
+cmd:
+  description: The last command.
+  returned: If the command was run.
+  type: str
+msg:
+  description: The execution message.
+  returned: always
+  type: str
+stdout:
+  description: The standard output of the failed command.
+  returned: If the command failed.
+  type: str
+stderr:
+  description: The standard error of the failed command.
+  returned: If the command failed.
+  type: str
+'''
+
+import re
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.ibm.power_vios.plugins.module_utils.lsmap import (
+    delimiter, parse_net, parse_output, stream_command, command_failed,
+)
+
+
+ioscli_cmd = '/usr/ios/cli/ioscli'
+max_unparsed_lines = 100  # Lines of entstat output kept to report a failure
+# entstat counters reported in a transmit and a receive column
+counter_names = {
+    'Packets': ('tx_packets', 'rx_packets'),
+    'Bytes': ('tx_bytes', 'rx_bytes'),
+    'Transmit Errors': ('tx_errors', 'rx_errors'),
+    'Packets Dropped': ('tx_dropped', 'rx_dropped'),
+}
+error_names = ['tx_errors', 'rx_errors', 'tx_dropped', 'rx_dropped']
+# Name of the adapter that the next ETHERNET STATISTICS section is about
+adapter_roles = {
+    'Real Adapter': 'real',
+    'Virtual Adapter': 'virtual',
+    'Control Adapter': 'control',
+    'Control Channel Adapter': 'control',
+}
+# "Name: value" pairs, two on the lines with a transmit and a receive column
+pair_re = re.compile(r'\s*([A-Za-z][^:]*?)\s*:\s*(\S+)(?:\s{2,}([A-Za-z][^:]*?)\s*:\s*(\S+))?\s*$')
+results = dict(
+    changed=False,
+    cmd='',
+    msg='',
+    stdout='',
+    stderr='',
+)
+
+
+def net_mappings(module):
+    """
+    Return the SEA mappings.
+    """
+    cmd = [ioscli_cmd, 'lsmap', '-net', '-all', '-fmt', delimiter]
+    ret, stdout, stderr = module.run_command(cmd)
+    if ret != 0:
+        if ret in (10, 16):
+            return {}  # E_NODEVPHYSLOC or E_NOTSVEA_S
+        command_failed(module, results, cmd, ret, stdout, stderr)
+    return parse_output(stdout, parse_net, 6)
+
+
+class EntstatParser(object):
+    """
+    Parse the entstat -all output of a SEA one line at a time and keep the
+    counters and state of the SEA and of each of its adapters.
+    """
+
+    def __init__(self, sea):
+        self.sea = sea
+        self.adapters = {}
+        self.current = None
+        self.role = None
+
+    def feed(self, line):
+        """
+        Parse a line of entstat output.
+        """
+        line = line.rstrip()
+        if line.startswith('ETHERNET STATISTICS'):
+            name = line.partition('(')[2].partition(')')[0].strip()
+            self.current = self.adapters.setdefault(name, {})
+            self.current['role'] = 'sea' if name == self.sea else self.role or 'other'
+            self.role = None
+            return
+        name, sep, value = line.partition(':')
+        if sep and name.strip() in adapter_roles:
+            self.role = adapter_roles[name.strip()]
+            return
+        if self.current is None or not sep:
+            return
+        if name.strip() == 'VLAN Tag IDs':
+            self.current['vlans'] = [int(vlan) for vlan in value.split() if vlan.isdigit()]
+            return
+        if name.strip() == 'Media Speed Running':
+            # For instance "10000 Mbps Full Duplex" or "10 Gbps Full Duplex"
+            values = value.split()
+            if values and values[0].isdigit():
+                self.current['speed'] = int(values[0]) * (1000 if 'Gbps' in values[1:2] else 1)
+            return
+
+        match = pair_re.match(line)
+        if not match:
+            return
+        left, left_value, right, right_value = match.groups()
+        if right is not None and left in counter_names:
+            # Transmit column on the left, receive column on the right
+            tx_key, rx_key = counter_names[left]
+            if tx_key not in self.current and left_value.isdigit() and right_value.isdigit():
+                self.current[tx_key] = int(left_value)
+                self.current[rx_key] = int(right_value)
+            return
+        pairs = [(left, left_value)] + ([(right, right_value)] if right is not None else [])
+        for key, value in pairs:
+            self.attribute(key, value)
+
+    def attribute(self, key, value):
+        """
+        Keep the state attributes of the current adapter.
+        """
+        adapter = self.current
+        if key == 'State' and 'state' not in adapter:
+            adapter['state'] = value
+        elif key == 'High Availability Mode':
+            adapter['ha_mode'] = value
+        elif key == 'Bridge Mode':
+            adapter['bridge_mode'] = value
+        elif key == 'Priority' and value.isdigit() and 'priority' not in adapter:
+            adapter['priority'] = int(value)
+        elif key == 'Active':
+            adapter['active'] = value.lower() == 'true'
+        elif key == 'Trunk Adapter':
+            adapter['trunk'] = value.lower() == 'true'
+        elif key == 'Port VLAN ID' and value.isdigit():
+            adapter['pvid'] = int(value)
+        elif key == 'Link Status':
+            adapter['link_status'] = value
+
+
+def run_entstat(module, sea):
+    """
+    Run entstat on a SEA and parse its output as it is produced.
+    Return a tuple (time, rc, adapters, stdout, stderr), time is when the
+    command completed and stdout has the beginning of the output.
+    """
+    cmd = [ioscli_cmd, 'entstat', '-all', sea]
+    parser = EntstatParser(sea)
+    head = []
+
+    def consume(line):
+        if len(head) < max_unparsed_lines:
+            head.append(line)
+        parser.feed(line)
+
+    ret, stderr = stream_command(module, cmd, consume)
+    return time.time(), ret, parser.adapters, ''.join(head), stderr
+
+
+def sample_seas(module, seas):
+    """
+    Run entstat on all the SEAs concurrently.
+    Return a dict of SEA name to (time, adapters).
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(len(seas), 16))) as executor:
+        futures = dict((sea, executor.submit(run_entstat, module, sea)) for sea in seas)
+        outputs = dict((sea, future.result()) for sea, future in futures.items())
+
+    samples = {}
+    for sea, (timestamp, ret, adapters, stdout, stderr) in outputs.items():
+        if ret != 0:
+            command_failed(module, results, [ioscli_cmd, 'entstat', '-all', sea], ret, stdout, stderr)
+        if sea not in adapters:
+            results['msg'] = f'Cannot parse entstat output of {sea}'
+            results['stdout'] = stdout
+            module.fail_json(**results)
+        samples[sea] = (timestamp, adapters)
+    return samples
+
+
+def adapter_load(before, after, elapsed):
+    """
+    Compute the rates of an adapter between two samples.
+    Counters that went backwards were reset, their rate is computed from zero.
+    """
+    def delta(key):
+        value = after.get(key, 0)
+        return value - before.get(key, 0) if value >= before.get(key, 0) else value
+
+    load = dict((key, value) for key, value in after.items() if not key.startswith(('tx_', 'rx_')))
+    load['tx_mbps'] = round(delta('tx_bytes') / elapsed / 1024 ** 2, 2)
+    load['rx_mbps'] = round(delta('rx_bytes') / elapsed / 1024 ** 2, 2)
+    load['mbps'] = round(load['tx_mbps'] + load['rx_mbps'], 2)
+    load['tx_pps'] = round(delta('tx_packets') / elapsed, 1)
+    load['rx_pps'] = round(delta('rx_packets') / elapsed, 1)
+    load['errors'] = dict((key, after.get(key, 0)) for key in error_names)
+    load['new_errors'] = dict((key, delta(key)) for key in error_names)
+    if load.get('speed'):
+        # Link speed in Mb/s against the busiest direction
+        busiest = max(delta('tx_bytes'), delta('rx_bytes')) * 8 / elapsed / 10 ** 6
+        load['utilization'] = round(busiest * 100.0 / load['speed'], 1)
+    return load
+
+
+def sea_load(first, second):
+    """
+    Compute the state and rates of a SEA and of its adapters between two samples.
+    Adapters missing from the first sample are skipped, their counters since the
+    last reset would be taken as their traffic over the interval.
+    """
+    (start, before), (end, after) = first, second
+    elapsed = max(end - start, 0.001)
+    loads = dict((name, adapter_load(before[name], counters, elapsed))
+                 for name, counters in after.items() if name in before)
+    sea = [name for name, load in loads.items() if load['role'] == 'sea'][0]
+    load = loads.pop(sea)
+    del load['role']
+    load['interval'] = round(elapsed, 2)
+    load['adapters'] = loads
+    return load
+
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            interval=dict(type='int', default=5),
+            seas=dict(type='list', elements='str'),
+            mappings=dict(type='dict'),
+        ),
+        supports_check_mode=True
+    )
+
+    if module.params['interval'] < 1:
+        results['msg'] = 'interval must be at least 1 second'
+        module.fail_json(**results)
+
+    if module.params['mappings'] is not None:
+        net = module.params['mappings'].get('net', {})
+    else:
+        net = net_mappings(module)
+    seas = module.params['seas'] or sorted(set(mapping['sea'] for mapping in net.values() if mapping.get('sea')))
+    if not seas:
+        results['ansible_facts'] = dict(seas={})
+        results['msg'] = 'No shared Ethernet adapter found'
+        module.exit_json(**results)
+
+    first = sample_seas(module, seas)
+    time.sleep(module.params['interval'])
+    second = sample_seas(module, seas)
+
+    facts = {}
+    for sea in seas:
+        facts[sea] = sea_load(first[sea], second[sea])
+        facts[sea]['mappings'] = sorted(svea for svea, mapping in net.items() if mapping.get('sea') == sea)
+
+    results['ansible_facts'] = dict(seas=facts)
+    results['msg'] = f'{len(seas)} SEAs sampled over {module.params["interval"]} seconds'
+    module.exit_json(**results)
+
+
+if __name__ == '__main__':
+    main()